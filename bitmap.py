@@ -2,9 +2,114 @@
 from disk import Disk
 from layout import Superblock
 from transaction import Transaction
-from typing import Optional
+from typing import Iterable, Optional
+from itertools import groupby
+import logging
+
+log = logging.getLogger(__name__)
+
+WORD_BITS = 64
+WORD_BYTES = WORD_BITS // 8
+FULL_WORD = b"\xff" * WORD_BYTES
+WORD_MASK = (1 << WORD_BITS) - 1
+
+
+def popcount(buf) -> int:
+    n = int.from_bytes(buf, "little")
+    # int.bit_count (3.10+) avoids building the bin() string
+    return n.bit_count() if hasattr(n, "bit_count") else bin(n).count("1")
+
+
+def skip_bytes(buf, byte_off: int, end_byte: int, fill: bytes) -> int:
+    """
+    return: offset of the first byte in [byte_off, end_byte) that is not fill, or end_byte
+    """
+    # lstrip runs in C; windows grow geometrically, so a hit close to byte_off copies only a
+    # few bytes and a long run still takes O(log n) copies instead of one of the whole tail
+    window = 64
+    while byte_off < end_byte:
+        chunk = bytes(buf[byte_off:min(end_byte, byte_off + window)])
+        rest = chunk.lstrip(fill)
+        byte_off += len(chunk) - len(rest)
+        if rest:
+            break
+        window <<= 2
+    return min(byte_off, end_byte)
+
+
+def first_zero_bit(buf, start: int, limit: int) -> int:
+    """
+    buf: bytes-like bitmap
+    return: index of the first clear bit in [start, limit), or -1
+    """
+    if start >= limit:
+        return -1
+    byte_off = start >> 3
+
+    # first byte: mark bits below start as used so CTZ skips them
+    used = buf[byte_off] | ((1 << (start & 7)) - 1)
+    if used == 0xFF:
+        # skip fully used (0xFF) bytes in C instead of testing bit by bit,
+        # but never past the byte holding limit
+        end_byte = (limit + 7) >> 3
+        byte_off = skip_bytes(buf, byte_off + 1, end_byte, b"\xff")
+        if byte_off >= end_byte:
+            return -1
+        used = buf[byte_off]
+
+    # CTZ of the inverted byte = lowest free bit
+    free = ~used & 0xFF
+    idx = byte_off * 8 + (free & -free).bit_length() - 1
+    return idx if idx < limit else -1
+
+
+def first_set_bit(buf, start: int, limit: int) -> int:
+    """
+    buf: bytes-like bitmap
+    return: index of the first set bit in [start, limit), or -1
+    """
+    if start >= limit:
+        return -1
+    byte_off = start >> 3
+
+    # first byte: drop bits below start
+    bits = buf[byte_off] & (0xFF << (start & 7)) & 0xFF
+    if not bits:
+        # skip clear bytes in C, but never past the byte holding limit
+        end_byte = (limit + 7) >> 3
+        byte_off = skip_bytes(buf, byte_off + 1, end_byte, b"\x00")
+        if byte_off >= end_byte:
+            return -1
+        bits = buf[byte_off]
+
+    idx = byte_off * 8 + (bits & -bits).bit_length() - 1
+    return idx if idx < limit else -1
+
+
+def fill_bits(buf, start: int, count: int, value: bool):
+    """
+    Set (value=True) or clear bits [start, start + count) of buf.
+    """
+    # head bits, middle bytes as one slice store, tail bits
+    if count <= 0:
+        return
+    end = start + count - 1
+    first_byte, last_byte = start >> 3, end >> 3
+    head_mask = (0xFF << (start & 7)) & 0xFF
+    tail_mask = 0xFF >> (7 - (end & 7))
+    if first_byte == last_byte:
+        head_mask &= tail_mask
+    else:
+        if last_byte - first_byte > 1:
+            buf[first_byte + 1 : last_byte] = (b"\xff" if value else b"\x00") * (last_byte - first_byte - 1)
+        buf[last_byte] = buf[last_byte] | tail_mask if value else buf[last_byte] & ~tail_mask
+    buf[first_byte] = buf[first_byte] | head_mask if value else buf[first_byte] & ~head_mask
+
 
 class Bitmap:
+    __slots__ = ("disk", "sb", "start_block", "num_blocks", "total_items", "bitmap_type", "free_count", "buf", "_mv",
+                 "_num_words", "_full_words", "_free_hint", "_dirty_blocks", "_bits_per_block", "_region")
+
     def __init__(self, disk: Disk, sb: Superblock, start_block: int, num_blocks: int, total_items: int, bitmap_type: str = "Default"):
         self.disk = disk
         self.sb = sb
@@ -13,73 +118,252 @@ class Bitmap:
         self.total_items = total_items
         self.bitmap_type = bitmap_type
         self.free_count = 0
-        total_set_bits = 0
 
+        # map the bitmap region instead of reading it block by block;
+        # the mapping is private, so on-disk updates still go through flush()
         total_bytes = (total_items + 7) // 8
-        buf = bytearray()
-        for i in range(num_blocks):
-            buf += self.disk.read_block(start_block + i)
-        print(f"--- Recalculating free count for {bitmap_type} ({total_items} items) ---") 
-        self.buf = bytearray(buf[:total_bytes])
-        for i in range(total_items):
-            total_set_bits += 1 if self.is_set(i) else 0
-        
+        region = self.disk.mmap_region(start_block * sb.block_size, num_blocks * sb.block_size)
+        self.buf = region[:total_bytes]
+        self._region = region
+        self._mv = self.buf
+        self._num_words = (total_bytes + WORD_BYTES - 1) // WORD_BYTES
+        self._bits_per_block = sb.block_size * 8
+        self._load()
+
+    def _load(self):
+        # derive every summary from the bits now in the mapping
+        total_bytes = len(self.buf)
+        # past the last item every block is written back as zeros: clear that tail once in the
+        # private mapping, so flush hands out whole blocks of it with no padded copies
+        self._region[total_bytes:] = bytes(len(self._region) - total_bytes)
+        total_set_bits = popcount(self.buf)
+
         self.free_count = self.total_items - total_set_bits
-        print(f"    Total set: {total_set_bits}, Free count: {self.free_count}") 
+        log.debug("%s: %d of %d items set, %d free", self.bitmap_type, total_set_bits, self.total_items, self.free_count)
+
+        # summary level: bit k is set iff 64-bit word k of buf is all ones
+        self._full_words = bytearray((self._num_words + 7) // 8)
+        for w in range(self._num_words):
+            if self._word_is_full(w):
+                self._full_words[w >> 3] |= 1 << (w & 7)
+
+        # bit b is set when bitmap block b has changes not yet flushed
+        self._dirty_blocks = bytearray((self.num_blocks + 7) // 8)
+
+        # every entry below _free_hint is known to be used
+        self._free_hint = 0
+        self._free_hint = self.find_free_entry(0)
+        if self._free_hint < 0:
+            self._free_hint = self.total_items
 
-    def _byte_bit(self, idx):
+    def reload(self):
+        """
+        Drop every change not yet flushed: read the bitmap back from disk into the mapping.
+        """
+        self.disk.read_into(self.start_block * self.sb.block_size, self._region)
+        self._load()
+
+    def _word_is_full(self, w: int) -> bool:
+        return self._mv[w * WORD_BYTES : (w + 1) * WORD_BYTES] == FULL_WORD
+
+    def _check_range(self, idx):
         if not 0 <= idx < self.total_items:
-            raise IndexError(f"Bitmap index {idx} out of range (0-{self.total_items}")
-        return idx // 8, idx % 8
+            raise IndexError(f"Bitmap index {idx} out of range (0-{self.total_items})")
 
+    # bounds check only runs under __debug__, so `python -O` drops it
     def is_set(self, idx: int) -> bool:
-        b, bit = self._byte_bit(idx)
-        return (self.buf[b] >> bit) & 1 == 1
+        if __debug__:
+            self._check_range(idx)
+        return (self._mv[idx >> 3] >> (idx & 7)) & 1 == 1
 
     def set(self, idx: int):
-        if self.is_set(idx):
+        if __debug__:
+            self._check_range(idx)
+        mask = 1 << (idx & 7)
+        if self.buf[idx >> 3] & mask:
             return
         self.free_count -= 1
-        b, bit = self._byte_bit(idx)
-        self.buf[b] |= (1 << bit)
+        self.buf[idx >> 3] |= mask
+        self._mark_dirty(idx)
+        if self.buf[idx >> 3] == 0xFF:
+            w = idx >> 6
+            if self._word_is_full(w):
+                self._full_words[w >> 3] |= 1 << (w & 7)
 
     def clear(self, idx: int):
-        if not self.is_set(idx):
+        if __debug__:
+            self._check_range(idx)
+        mask = 1 << (idx & 7)
+        if not self.buf[idx >> 3] & mask:
             return
         self.free_count += 1
-        b, bit = self._byte_bit(idx)
-        self.buf[b] &= ~(1 << bit)
+        self.buf[idx >> 3] &= ~mask
+        self._mark_dirty(idx)
+        w = idx >> 6
+        self._full_words[w >> 3] &= ~(1 << (w & 7))
+        if idx < self._free_hint:
+            self._free_hint = idx
+
+    def set_range(self, start: int, count: int):
+        """
+        Mark [start, start + count) used.
+        """
+        self._fill_range(start, count, True)
+
+    def clear_range(self, start: int, count: int):
+        """
+        Mark [start, start + count) free.
+        """
+        self._fill_range(start, count, False)
+
+    def clear_many(self, idxs: Iterable[int]):
+        """
+        Mark every entry of idxs free; each run of adjacent entries is cleared as one range.
+        """
+        # consecutive entries share the same (idx - position) key
+        for _, run in groupby(enumerate(sorted(idxs)), key=lambda pos_idx: pos_idx[1] - pos_idx[0]):
+            run = [idx for _, idx in run]
+            self.clear_range(run[0], len(run))
+
+    def _fill_range(self, start: int, count: int, used: bool):
+        if count <= 0:
+            return
+        end = start + count - 1
+        if __debug__:
+            self._check_range(start)
+            self._check_range(end)
+        first_byte, last_byte = start >> 3, end >> 3
+        set_before = popcount(self._mv[first_byte : last_byte + 1])
+        fill_bits(self._mv, start, count, used)
+        set_after = popcount(self._mv[first_byte : last_byte + 1])
+        self.free_count -= set_after - set_before
+
+        # summary: words strictly inside the range are now all ones (or all free),
+        # only the two edge words need checking
+        first_word, last_word = start >> 6, end >> 6
+        if used:
+            fill_bits(self._full_words, first_word + 1, last_word - first_word - 1, True)
+            for w in {first_word, last_word}:
+                if self._word_is_full(w):
+                    self._full_words[w >> 3] |= 1 << (w & 7)
+        else:
+            fill_bits(self._full_words, first_word, last_word - first_word + 1, False)
+
+        first_blk, last_blk = first_byte // self.sb.block_size, last_byte // self.sb.block_size
+        fill_bits(self._dirty_blocks, first_blk, last_blk - first_blk + 1, True)
+        if not used and start < self._free_hint:
+            self._free_hint = start
 
     def find_free_entry(self, start_idx: int = 0) -> int:
-        i = start_idx
-        while i < self.total_items:
-            if not self.is_set(i):
-                return i
-            i += 1
-        return -1
+        hinted = start_idx <= self._free_hint
+        if self.free_count == 0:
+            # a full map answers at once, e.g. for every create in an ENOSPC storm
+            if hinted:
+                self._free_hint = self.total_items
+            return -1
+        start_idx = max(start_idx, self._free_hint)
+
+        # walk non-full words via the summary, then CTZ inside the word
+        w = start_idx >> 6
+        bit = start_idx & (WORD_BITS - 1)
+        found = -1
+        while 0 <= w < self._num_words:
+            if not (self._full_words[w >> 3] >> (w & 7)) & 1:
+                # whole word as one int: free bits at or above `bit`, lowest via CTZ
+                free = ~int.from_bytes(self._mv[w * WORD_BYTES : (w + 1) * WORD_BYTES], "little") & (WORD_MASK << bit) & WORD_MASK
+                if free:
+                    idx = w * WORD_BITS + (free & -free).bit_length() - 1
+                    if idx < self.total_items:
+                        found = idx
+                    break
+            w = first_zero_bit(self._full_words, w + 1, self._num_words)
+            bit = 0
+
+        if hinted:
+            self._free_hint = found if found >= 0 else self.total_items
+        return found
     
+    def allocate(self, start_idx: int = 0) -> int:
+        """
+        Find the first free entry at or after start_idx and mark it used.
+        return: the entry, or -1 if none is free
+        """
+        idx = self.find_free_entry(start_idx)
+        if idx < 0:
+            return -1
+        self.set(idx)
+        # the entry just taken was the lowest free one, so the next search starts after it
+        if idx == self._free_hint:
+            self._free_hint = idx + 1
+        return idx
+
+    def find_free_run(self, start_idx: int, count: int) -> int:
+        """
+        return: first entry of count consecutive free entries at or after start_idx, or -1
+        """
+        if count > self.free_count:
+            return -1
+        idx = self.find_free_entry(start_idx)
+        while idx >= 0:
+            end = idx + count
+            if end > self.total_items:
+                return -1
+            used = first_set_bit(self._mv, idx, end)
+            if used < 0:
+                return idx
+            # the window holds a used entry; the next candidate starts after it
+            idx = self.find_free_entry(used + 1)
+        return -1
+
+    def _mark_dirty(self, idx: int):
+        blk = idx // self._bits_per_block
+        self._dirty_blocks[blk >> 3] |= 1 << (blk & 7)
+
+    def has_dirty(self) -> bool:
+        """
+        return: whether any bitmap block changed since the last flush
+        """
+        return any(self._dirty_blocks)
+
     def flush(self, tx: Optional[Transaction] = None):
-        padded_buf = bytearray(self.num_blocks * self.sb.block_size)
-        padded_buf[:len(self.buf)] = self.buf
+        # only write bitmap blocks touched since the last flush,
+        # one write per run of adjacent dirty blocks
+        if not self.has_dirty():
+            # most operations flush both bitmaps but change at most one
+            return
+        run_start = None
+        for blk in range(self.num_blocks + 1):
+            dirty = blk < self.num_blocks and (self._dirty_blocks[blk >> 3] >> (blk & 7)) & 1
+            if dirty and run_start is None:
+                run_start = blk
+            elif not dirty and run_start is not None:
+                self._write_run(run_start, blk, tx)
+                run_start = None
+
+        self._dirty_blocks[:] = bytes(len(self._dirty_blocks))
 
+    def _write_run(self, first_blk: int, end_blk: int, tx: Optional[Transaction]):
+        bs = self.sb.block_size
         if tx:
-            data_ptr = 0
-            for i in range(self.num_blocks):
-                block_data = padded_buf[data_ptr : data_ptr + self.sb.block_size]
-                print(f"[DEBUG] flush {self.bitmap_type} {i} buf size = {len(bytes(self.buf[data_ptr:data_ptr+self.sb.block_size]))}")
-                tx.write(self.start_block + i, block_data, self.bitmap_type)
-                data_ptr += self.sb.block_size
+            # the transaction copies each block into its arena, so hand it views of the map
+            for blk in range(first_blk, end_blk):
+                tx.write(self.start_block + blk, self._region[blk * bs : (blk + 1) * bs], self.bitmap_type)
         else:
-            self.disk.write_at(self.start_block * self.sb.block_size, padded_buf)
+            self.disk.write_at((self.start_block + first_blk) * bs, self._region[first_blk * bs : end_blk * bs])
 
 
         
 class InodeBitmap(Bitmap):
+    __slots__ = ()
+
     def __init__(self, disk: Disk, sb: Superblock):
         super().__init__(disk, sb, sb.inode_bitmap_start, sb.inode_bitmap_blocks, sb.inode_count, "Inode Bitmap")
 
     def find_free_inode(self, start_idx: int = 0) -> int:
         return self.find_free_entry(max(1, start_idx))
+
+    def alloc_inode(self, start_idx: int = 0) -> int:
+        return self.allocate(max(1, start_idx))
     
     def set_used(self, ino: int):
         self.set(ino)
@@ -89,14 +373,35 @@ class InodeBitmap(Bitmap):
 
 
 class BlockBitmap(Bitmap):
+    __slots__ = ()
+
     def __init__(self, disk: Disk, sb: Superblock):
         super().__init__(disk, sb, sb.block_bitmap_start, sb.block_bitmap_blocks, sb.total_blocks, "Block Bitmap")
 
     def find_free_block(self, start_idx: int = 0) -> int:
         return self.find_free_entry(max(1, start_idx))
+
+    def alloc_block(self, start_idx: int = 0) -> int:
+        return self.allocate(max(1, start_idx))
     
     def set_used(self, blk_idx: int):
         self.set(blk_idx)
 
+    def alloc_run(self, start_idx: int, count: int) -> int:
+        """
+        Mark count consecutive free blocks at or after start_idx used.
+        return: the first block of the run, or -1 if there is no such run
+        """
+        start = self.find_free_run(max(1, start_idx), count)
+        if start >= 0:
+            self.set_range(start, count)
+        return start
+
+    def set_range_used(self, start: int, end: int):
+        """
+        Mark blocks [start, end] used.
+        """
+        self.set_range(start, end - start + 1)
+
     def clear_used(self, blk_idx: int):
         self.clear(blk_idx)
\ No newline at end of file
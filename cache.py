@@ -1,39 +1,250 @@
+import mmap
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+from disk import Disk
+from layout import Inode
 
-from typing import Dict
+PAGE_CACHE_CAPACITY = 4096   # pages
+DENTRY_CACHE_CAPACITY = 4096 # entries
+DIR_CACHE_CAPACITY = 256     # directories
+ATTR_CACHE_CAPACITY = 4096   # inodes
+INODE_CACHE_CAPACITY = 4096  # inodes
 
 class CachedPage:
-    def __init__(self, data: bytes):
-        self.data = bytearray(data)
+    __slots__ = ("slot", "data", "dirty")
+
+    def __init__(self, slot: int, data: memoryview):
+        self.slot = slot
+        self.data = data  # view of this page's slot in the slab
         self.dirty = False
 
 
 class PageCache:
-    def __init__(self):
-        self._cache: Dict[int, CachedPage] = {}
+    def __init__(self, disk: Disk, capacity: int = PAGE_CACHE_CAPACITY):
+        self.disk = disk
+        self.capacity = capacity
+        self.block_size = disk.block_size
+        # one contiguous slab holds every cached page; pages are views of their slot. An anonymous
+        # mapping rather than a bytearray: page-aligned slots, and memory is only committed for
+        # slots that are used, instead of zeroing the whole capacity at mount
+        self._slab = memoryview(mmap.mmap(-1, capacity * self.block_size))
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        # LRU order: oldest first, most recently used last
+        self._cache: Dict[int, CachedPage] = OrderedDict()
+        # addresses of dirty pages, kept in step with CachedPage.dirty
+        self._dirty: Set[int] = set()
+        # pages were written back on eviction since the last data barrier
+        self.unsynced = False
 
-    def get(self, block_addr) -> CachedPage:
-        return self._cache[block_addr]
+    def get(self, block_addr) -> Optional[CachedPage]:
+        """
+        return: the cached page, or None on a miss
+        """
+        page = self._cache.get(block_addr)
+        if page is not None:
+            self._cache.move_to_end(block_addr)
+        return page
         
-    def put(self, block_addr, data: bytes):
-        self._cache[block_addr] = CachedPage(data)
+    def put(self, block_addr, data: bytes) -> CachedPage:
+        page = self._cache.get(block_addr)
+        if page is None:
+            page = self._new_page(block_addr)
+        else:
+            self.mark_clean(block_addr)
+        page.data[:] = data
+        self._cache.move_to_end(block_addr)
+        return page
+
+    def load(self, block_addr) -> CachedPage:
+        """
+        Cache block_addr on a miss, reading it from disk straight into its slab slot.
+        """
+        page = self.get(block_addr)
+        if page is None:
+            page = self._new_page(block_addr)
+            self.disk.read_into(block_addr * self.block_size, page.data)
+        return page
+
+    def load_run(self, block_addr, count) -> List[CachedPage]:
+        """
+        Cache count consecutive uncached blocks from block_addr with one vectored read into their slots.
+        count: at most capacity, so no page of the run is evicted by a later one
+        """
+        assert count <= self.capacity, "run larger than the cache"
+        pages = [self._new_page(block_addr + k) for k in range(count)]
+        self.disk.read_blocks_into(block_addr, [page.data for page in pages])
+        return pages
+
+    def _new_page(self, block_addr) -> CachedPage:
+        if not self._free_slots:
+            self._evict()
+        slot = self._free_slots.pop()
+        page = CachedPage(slot, self._slab[slot * self.block_size : (slot + 1) * self.block_size])
+        self._cache[block_addr] = page
+        return page
+
+    def _evict(self):
+        block_addr, page = self._cache.popitem(last=False)
+        # write back before dropping, otherwise the dirty data is lost
+        if page.dirty:
+            self._dirty.discard(block_addr)
+            self._write_back_run(block_addr, page)
+        self._free_slots.append(page.slot)
+
+    def _write_back_run(self, block_addr, page: CachedPage):
+        # a large write is evicted block by block in address order: take the dirty neighbours
+        # along, so the whole run goes out in one vectored write instead of one per eviction
+        lo = hi = block_addr
+        while lo - 1 in self._dirty:
+            lo -= 1
+        while hi + 1 in self._dirty:
+            hi += 1
+        run = [page.data if addr == block_addr else self._cache[addr].data for addr in range(lo, hi + 1)]
+        self.disk.write_blocks(lo, run)
+        for addr in range(lo, hi + 1):
+            if addr != block_addr:
+                self.mark_clean(addr)
+        self.unsynced = True
+
+    def discard(self, block_addr):
+        """
+        Drop a cached page without writing it back; for blocks rewritten on disk behind the cache.
+        """
+        page = self._cache.pop(block_addr, None)
+        if page is not None:
+            self._dirty.discard(block_addr)
+            self._free_slots.append(page.slot)
 
     def is_cached(self, block_addr) -> bool:
         return block_addr in self._cache
+
+    def refresh(self, block_addr, data: bytes):
+        """
+        Overwrite a cached page with data just written to disk behind the cache; no-op if not cached.
+        """
+        page = self._cache.get(block_addr)
+        if page is not None:
+            page.data[:] = data
     
+    def mark_dirty(self, block_addr):
+        self._cache[block_addr].dirty = True
+        self._dirty.add(block_addr)
+
+    def mark_clean(self, block_addr):
+        if block_addr in self._dirty:
+            self._cache[block_addr].dirty = False
+            self._dirty.discard(block_addr)
+
+    def has_dirty(self) -> bool:
+        return bool(self._dirty)
+
     def get_dirty_pages(self):
-        return [(block_addr, page) for block_addr, page in self._cache.items() if page.dirty]
+        return [(block_addr, self._cache[block_addr]) for block_addr in self._dirty]
 
 class DentryCache:
-    def __init__(self):
-        self._cache = {}
+    """
+    Name lookups: (dir ino, name) -> child ino. Keyed per hop rather than by full path, so a
+    rename or unlink drops exactly one pair and everything below a moved directory stays valid.
+    """
+    def __init__(self, capacity: int = DENTRY_CACHE_CAPACITY):
+        self.capacity = capacity
+        self._cache = OrderedDict()
 
-    def get(self, path: str):
-        return self._cache.get(path)
+    def get(self, parent_ino: int, name: str) -> Optional[int]:
+        key = (parent_ino, name)
+        ino = self._cache.get(key)
+        if ino is not None:
+            self._cache.move_to_end(key)
+        return ino
         
-    def put(self, path: str, ino: int):
-        self._cache[path] = ino
+    def put(self, parent_ino: int, name: str, ino: int):
+        key = (parent_ino, name)
+        self._cache[key] = ino
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def remove(self, parent_ino: int, name: str):
+        self._cache.pop((parent_ino, name), None)
+
+    def clear(self):
+        self._cache.clear()
+
+class AttrCache:
+    """
+    getattr results: ino -> stat dict, dropped whenever the inode is rewritten.
+    """
+    def __init__(self, capacity: int = ATTR_CACHE_CAPACITY):
+        self.capacity = capacity
+        self._cache = OrderedDict()
+
+    def get(self, ino: int) -> Optional[dict]:
+        attrs = self._cache.get(ino)
+        if attrs is not None:
+            self._cache.move_to_end(ino)
+        return attrs
+
+    def put(self, ino: int, attrs: dict):
+        self._cache[ino] = attrs
+        self._cache.move_to_end(ino)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def remove(self, ino: int):
+        self._cache.pop(ino, None)
+
+    def clear(self):
+        self._cache.clear()
+
+class InodeCache:
+    """
+    Decoded inodes: ino -> Inode, written through on every inode update.
+    The cached object is the one handed out and modified in place by the callers.
+    """
+    def __init__(self, capacity: int = INODE_CACHE_CAPACITY):
+        self.capacity = capacity
+        self._cache = OrderedDict()
+
+    def get(self, ino: int) -> Optional[Inode]:
+        inode = self._cache.get(ino)
+        if inode is not None:
+            self._cache.move_to_end(ino)
+        return inode
+
+    def put(self, ino: int, inode: Inode):
+        self._cache[ino] = inode
+        self._cache.move_to_end(ino)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def remove(self, ino: int):
+        self._cache.pop(ino, None)
+
+    def clear(self):
+        self._cache.clear()
+
+class DirCache:
+    """
+    Decoded directory blocks: dir data block addr -> {name: ino}.
+    """
+    def __init__(self, capacity: int = DIR_CACHE_CAPACITY):
+        self.capacity = capacity
+        self._cache = OrderedDict()
+
+    def get(self, block_addr: int) -> Optional[Dict[str, int]]:
+        names = self._cache.get(block_addr)
+        if names is not None:
+            self._cache.move_to_end(block_addr)
+        return names
+
+    def put(self, block_addr: int, names: Dict[str, int]):
+        self._cache[block_addr] = names
+        self._cache.move_to_end(block_addr)
+        if len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def remove(self, block_addr: int):
+        self._cache.pop(block_addr, None)
 
-    def remove(self, path: str):
-        if self.get(path) is None:
-            return
-        del self._cache[path]
\ No newline at end of file
+    def clear(self):
+        self._cache.clear()
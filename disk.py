@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 import os
+import mmap
+from itertools import groupby
+
+IOV_MAX = 1024  # POSIX minimum upper bound on iovecs per pwritev
 
 class Disk:
-    def __init__(self, path, block_size=None):
+    def __init__(self, path, block_size=None, flags=0):
+        # flags: extra os.open flags, e.g. O_CREAT | O_TRUNC when building a new image
         self.path = path
-        self.fd = os.open(path, os.O_RDWR)
+        self.fd = os.open(path, os.O_RDWR | flags, 0o644)
         self.block_size = block_size or 4096  # may be updated by layout.Superblock.load()
+        self._zero_block = None
 
     def close(self):
         if self.fd is not None:
@@ -18,6 +24,34 @@ class Disk:
     def write_at(self, offset, data):
         return os.pwrite(self.fd, data, offset)
 
+    def read_into(self, offset, buf):
+        """
+        Read len(buf) bytes at offset straight into buf, without an intermediate bytes object.
+        buf: writable buffer, e.g. a page cache slot
+        """
+        if hasattr(os, "preadv"):
+            return os.preadv(self.fd, [buf], offset)
+        data = self.read_at(offset, len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def read_blocks_into(self, blkno, bufs):
+        """
+        Read consecutive blocks from blkno straight into bufs, one preadv per IOV_MAX buffers.
+        bufs: List[writable buffer], one block each
+        """
+        off = blkno * self.block_size
+        for i in range(0, len(bufs), IOV_MAX):
+            chunk = bufs[i:i + IOV_MAX]
+            if hasattr(os, "preadv"):
+                os.preadv(self.fd, chunk, off)
+            else:
+                data = self.read_at(off, len(chunk) * self.block_size)
+                for k, buf in enumerate(chunk):
+                    piece = data[k * self.block_size : (k + 1) * self.block_size]
+                    buf[:len(piece)] = piece
+            off += len(chunk) * self.block_size
+
     def read_block(self, blkno):
         off = blkno * self.block_size
         return self.read_at(off, self.block_size)
@@ -27,5 +61,89 @@ class Disk:
         off = blkno * self.block_size
         return self.write_at(off, data)
 
+    def read_blocks(self, blkno, count):
+        off = blkno * self.block_size
+        return self.read_at(off, count * self.block_size)
+
+    def write_blocks(self, blkno, blocks):
+        """
+        Write full blocks to blkno, blkno + 1, ... with as few syscalls as possible.
+        blocks: List[bytes]
+        """
+        off = blkno * self.block_size
+        for i in range(0, len(blocks), IOV_MAX):
+            chunk = blocks[i:i + IOV_MAX]
+            assert all(len(data) == self.block_size for data in chunk), "must write full block"
+            if len(chunk) == 1:
+                self.write_at(off, chunk[0])
+            elif hasattr(os, "pwritev"):
+                os.pwritev(self.fd, chunk, off)
+            else:
+                self.write_at(off, b"".join(chunk))
+            off += len(chunk) * self.block_size
+
+    def write_scattered(self, blocks):
+        """
+        Write blocks to arbitrary addresses, one pwritev per run of consecutive addresses.
+        blocks: List[Tuple[int, bytes]] sorted by block address
+        """
+        # consecutive addresses share the same (addr - position) key
+        for _, run in groupby(enumerate(blocks), key=lambda pos_block: pos_block[1][0] - pos_block[0]):
+            run = [block for _, block in run]
+            self.write_blocks(run[0][0], [data for _, data in run])
+
+    def zero_blocks(self, addrs):
+        """
+        Zero blocks at arbitrary addresses; every iovec points at one shared zero buffer.
+        addrs: List[int] sorted block addresses
+        """
+        zero = self._zero_block
+        if zero is None or len(zero) != self.block_size:
+            zero = self._zero_block = bytes(self.block_size)
+        for _, run in groupby(enumerate(addrs), key=lambda pos_addr: pos_addr[1] - pos_addr[0]):
+            run = [addr for _, addr in run]
+            self.write_blocks(run[0], [zero] * len(run))
+
+    def mmap_region(self, offset, length):
+        """
+        Copy-on-write mapping of [offset, offset + length).
+        Stores into the view stay private; callers write them back explicitly.
+        return: memoryview
+        """
+        delta = offset % mmap.ALLOCATIONGRANULARITY
+        region = mmap.mmap(self.fd, length + delta, access=mmap.ACCESS_COPY, offset=offset - delta)
+        return memoryview(region)[delta:delta + length]
+
+    def fallocate(self, offset, length):
+        # reserve the extent up front so later writes do not change file metadata
+        if hasattr(os, "posix_fallocate"):
+            os.posix_fallocate(self.fd, offset, length)
+        elif os.fstat(self.fd).st_size < offset + length:
+            os.ftruncate(self.fd, offset + length)
+
+    def prefetch(self, offset, length):
+        # start readahead for a range we are about to read sequentially
+        # (a zero length would mean "to end of file")
+        if length > 0 and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, offset, length, os.POSIX_FADV_WILLNEED)
+
+    def drop_cache(self, offset, length):
+        # evict a range that was written and synced but will not be read back soon
+        if length > 0 and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+    def open_dsync(self):
+        """
+        Open a second descriptor on the image whose writes return only once the data is durable.
+        return: fd
+        """
+        return os.open(self.path, os.O_RDWR | getattr(os, "O_DSYNC", os.O_SYNC))
+
     def fsync(self):
         os.fsync(self.fd)
+
+    def fdatasync(self):
+        if hasattr(os, "fdatasync"):
+            os.fdatasync(self.fd)
+        else:
+            os.fsync(self.fd)
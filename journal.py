@@ -1,16 +1,44 @@
 from disk import Disk
 from layout import Superblock
 from transaction import Transaction
+import os
 import struct
-from typing import List
+import time
+import array
+import sys
+from typing import Callable, Optional
 from dataclasses import dataclass
 from enum import Enum
 from contextlib import contextmanager
 from cache import PageCache
+import logging
+
+log = logging.getLogger(__name__)
 
 JOURNAL_SB_MAGIC = b"WAYNE_JOURNAL_SB"
 JOURNAL_MAGIC = b"WAYNE_JOURNAL"
 JOURNAL_SIZE = 1024
+LOG_BUF_KEEP = 128 * 1024  # commit buffer is shrunk back to this after a large transaction
+CHECKPOINT_SYNC_INTERVAL = 0.01  # seconds; commits within one interval share a checkpoint barrier
+RECOVER_READAHEAD_MIN = 16 * 1024  # first readahead window for a long recovery scan
+RECOVER_READAHEAD_MAX = 1024 * 1024  # window cap; logs up to this size are prefetched whole
+
+# journal area of an image made without an explicit size, unless its geometry needs more
+DEFAULT_JOURNAL_BLOCKS = 10
+
+
+def min_journal_area_blocks(inode_bitmap_blocks: int, block_bitmap_blocks: int, inode_table_blocks: int) -> int:
+    """
+    return: the smallest journal area whose log holds the largest transaction an operation builds
+    """
+    # a rename over a directory or a large file: the inode table blocks of the target, the moved
+    # inode and both parents, plus every bitmap block the freed blocks may fall in
+    max_tx_blocks = min(4, inode_table_blocks) + inode_bitmap_blocks + block_bitmap_blocks
+    # journal superblock, then descriptor + blocks + commit, kept shorter than the log
+    return 1 + max_tx_blocks + 2 + 1
+
+# array typecode for little-endian u32 block addresses
+ADDR_TYPECODE = "I" if array.array("I").itemsize == 4 else "L"
 
 class JournalBlockType(Enum):
     BLOCK_TYPE_DESCRIPTOR = 1
@@ -27,18 +55,24 @@ class JournalSuperblock:
     last_tid: int
 
     FORMAT = "<16sIIIII"
+    STRUCT = struct.Struct(FORMAT)
+    # same layout with the magic skipped, for decoding once the magic has been checked
+    FIELDS_STRUCT = struct.Struct("<16xIIIII")
 
     def pack(self) -> bytes:
-        return struct.pack(self.FORMAT, self.magic, self.start_block, self.num_blocks, self.head, self.tail, self.last_tid)
+        return self.STRUCT.pack(self.magic, self.start_block, self.num_blocks, self.head, self.tail, self.last_tid)
+
+    def pack_into(self, buf: bytearray, offset: int = 0):
+        self.STRUCT.pack_into(buf, offset, self.magic, self.start_block, self.num_blocks, self.head, self.tail, self.last_tid)
     
     @classmethod
     def unpack(cls, data: bytes) -> "JournalSuperblock":
-        magic, start_block, num_blocks, head, tail, last_tid = struct.unpack(cls.FORMAT, data[:struct.calcsize(cls.FORMAT)])
-
-        if magic != JOURNAL_SB_MAGIC:
+        # compare the magic in place instead of decoding it into a new bytes object
+        if not data.startswith(JOURNAL_SB_MAGIC):
             raise ValueError("Invalid journal superblock magic")
 
-        return cls(magic, start_block, num_blocks, head, tail, last_tid)
+        start_block, num_blocks, head, tail, last_tid = cls.FIELDS_STRUCT.unpack_from(data)
+        return cls(JOURNAL_SB_MAGIC, start_block, num_blocks, head, tail, last_tid)
 
 @dataclass
 class JournalHeader:
@@ -47,52 +81,78 @@ class JournalHeader:
     tid: int
 
     FORMAT = "<13sII"
+    STRUCT = struct.Struct(FORMAT)
+    FIELDS_STRUCT = struct.Struct("<13xII")
 
     def pack(self) -> bytes:
-        return struct.pack(self.FORMAT, self.magic, self.block_type, self.tid)
+        return self.STRUCT.pack(self.magic, self.block_type, self.tid)
+
+    def pack_into(self, buf: bytearray, offset: int = 0):
+        self.STRUCT.pack_into(buf, offset, self.magic, self.block_type, self.tid)
     
     @classmethod
     def unpack(cls, data: bytes) -> "JournalHeader":
-        magic, block_type, tid = struct.unpack(cls.FORMAT, data[:struct.calcsize(cls.FORMAT)])
-
-        if magic != JOURNAL_MAGIC:
+        if not data.startswith(JOURNAL_MAGIC):
             raise ValueError("Invalid journal header magic")
         
-        return cls(magic, block_type, tid)
+        block_type, tid = cls.FIELDS_STRUCT.unpack_from(data)
+        return cls(JOURNAL_MAGIC, block_type, tid)
 
 @dataclass
 class DescriptorBlock:
     header: JournalHeader
     num_blocks: int
-    final_block_addr: List[int]
+    final_block_addr: array.array  # ADDR_TYPECODE, native byte order
 
     FORMAT = "<I" 
     ADDR_FORMAT = "<I"
+    STRUCT = struct.Struct(FORMAT)
+    ADDR_STRUCT = struct.Struct(ADDR_FORMAT)
+
+    def size(self) -> int:
+        return JournalHeader.STRUCT.size + self.STRUCT.size + self.ADDR_STRUCT.size * len(self.final_block_addr)
 
     def pack(self) -> bytes:
-        data = bytearray()
-        data += self.header.pack()
-        data += struct.pack(self.FORMAT, self.num_blocks)
-        for addr in self.final_block_addr:
-            data += struct.pack(self.ADDR_FORMAT, addr)
+        data = bytearray(self.size())
+        self.pack_into(data)
         return bytes(data)
+
+    def pack_into(self, buf: bytearray, offset: int = 0):
+        header_size = JournalHeader.STRUCT.size
+        addr_start = offset + header_size + self.STRUCT.size
+        self.header.pack_into(buf, offset)
+        self.STRUCT.pack_into(buf, offset + header_size, self.num_blocks)
+        addrs = self.final_block_addr
+        if not isinstance(addrs, array.array) or addrs.typecode != ADDR_TYPECODE:
+            addrs = array.array(ADDR_TYPECODE, addrs)
+        if sys.byteorder != "little":
+            addrs = array.array(ADDR_TYPECODE, addrs)
+            addrs.byteswap()
+        # store straight from the array's buffer, no intermediate bytes copy
+        buf[addr_start : addr_start + len(addrs) * addrs.itemsize] = memoryview(addrs).cast("B")
     
     @classmethod
-    def unpack(cls, data: bytes) -> "DescriptorBlock":
+    def unpack(cls, data: bytes, header: Optional[JournalHeader] = None) -> "DescriptorBlock":
+        """
+        header: the block's JournalHeader if the caller already decoded it
+        """
         data_ptr = 0
-        header_size = struct.calcsize(JournalHeader.FORMAT)
-        header = struct.unpack(JournalHeader.FORMAT, data[data_ptr:data_ptr+header_size])
-        data_ptr += header_size
-        num_blocks = struct.unpack(cls.FORMAT, data[data_ptr:data_ptr+struct.calcsize(cls.FORMAT)])
-        data_ptr += struct.calcsize(cls.FORMAT)
-        final_block_addr = []
-        addr_size = struct.calcsize(cls.ADDR_FORMAT)
-
-        for addr in range(num_blocks):
-            final_block_addr.append(struct.unpack(cls.ADDR_FORMAT, data[data_ptr:data_ptr+addr_size]))
-            data_ptr += addr_size
-
-        return cls(header, num_blocks, final_block_addr)
+        if header is None:
+            header = JournalHeader.unpack(data)
+        data_ptr += JournalHeader.STRUCT.size
+        num_blocks, = cls.STRUCT.unpack_from(data, data_ptr)
+        data_ptr += cls.STRUCT.size
+
+        # decode every address in one C-level pass
+        addrs = array.array(ADDR_TYPECODE)
+        raw_addrs = memoryview(data)[data_ptr : data_ptr + num_blocks * addrs.itemsize]
+        if len(raw_addrs) != num_blocks * addrs.itemsize:
+            raise ValueError("Descriptor block address list is truncated")
+        addrs.frombytes(raw_addrs)
+        if sys.byteorder != "little":
+            addrs.byteswap()
+
+        return cls(header, num_blocks, addrs)
     
 @dataclass
 class CommitBlock:
@@ -101,6 +161,9 @@ class CommitBlock:
     def pack(self) -> bytes:
         return self.header.pack()
 
+    def pack_into(self, buf: bytearray, offset: int = 0):
+        self.header.pack_into(buf, offset)
+
     @classmethod
     def unpack(cls, data: bytes) -> "CommitBlock":
         return cls(JournalHeader.unpack(data))
@@ -128,13 +191,25 @@ class Journal():
 
         self.journal_area_start = sb.journal_area_start
         self.journal_area_total_blocks = sb.journal_area_total_blocks
+
+        # reusable scratch buffers (commit is single-threaded per Journal)
+        self._sb_buf = bytearray(sb.block_size)
+        self._zero_block = bytes(sb.block_size)
+        self._log_buf = bytearray(LOG_BUF_KEEP)
+        # the transaction begin() handles join until it commits
+        self._running: Optional[Transaction] = None
+
+        # log and journal superblock go through an O_DSYNC descriptor over a preallocated area,
+        # so every log write is durable on return without a separate fsync
+        self.disk.fallocate(self.journal_area_start * sb.block_size, self.journal_area_total_blocks * sb.block_size)
+        self._journal_fd = self.disk.open_dsync()
         
         try:
             raw_journal_sb = self.disk.read_block(self.journal_area_start)
             self.journal_sb = JournalSuperblock.unpack(raw_journal_sb)
-            print("Journal loaded successfully.")
+            log.info("Journal loaded successfully.")
         except (ValueError, struct.error):
-            print("Failed to load journal, initializing a new one.")
+            log.warning("Failed to load journal, initializing a new one.")
             log_start_block = self.journal_area_start + 1
 
             self.journal_sb = JournalSuperblock(
@@ -144,119 +219,259 @@ class Journal():
                 head=log_start_block, 
                 tail=log_start_block,
                 last_tid=0)
-            raw_journal_sb = self.journal_sb.pack()
-            self.disk.write_block(self.journal_area_start, raw_journal_sb.ljust(self.main_sb.block_size, b'\x00'))
+            self._write_journal_sb()
+
+        # circular log bounds, fixed for the life of the journal
+        self._log_start = self.journal_sb.start_block
+        self._log_end = self._log_start + self.journal_sb.num_blocks
+
+        # a span as long as the log would put tail on head; transactions stop short of that
+        self.max_tx_blocks = self.journal_sb.num_blocks - 3
+        # called with a transaction that outgrew the log, instead of committing it
+        self.on_abort: Optional[Callable[[Transaction], None]] = None
 
         self.next_tid = self.journal_sb.last_tid + 1
+        self._last_checkpoint_sync = time.monotonic()
+
+    def _write_journal_sb(self):
+        self.journal_sb.pack_into(self._sb_buf)
+        os.pwrite(self._journal_fd, self._sb_buf, self.journal_area_start * self.main_sb.block_size)
+
+    def close(self):
+        if self._journal_fd is not None:
+            self.sync_checkpoints()
+            os.close(self._journal_fd)
+            self._journal_fd = None
 
     def _get_next_log_block(self, current_block: int) -> int:
-        # (日誌紀錄區的相對位置 + 1) % 總數量
-        next_relative_pos = ((current_block - self.journal_sb.start_block) + 1) % self.journal_sb.num_blocks
-        return self.journal_sb.start_block + next_relative_pos
+        # 只有走到日誌紀錄區尾端才繞回起點
+        next_block = current_block + 1
+        return self._log_start if next_block >= self._log_end else next_block
 
     @contextmanager
     def begin(self):
+        # an operation built from others joins the transaction already running, like a JBD2
+        # handle: one log write and one barrier cover all of it, committed by the outermost
+        if self._running is not None:
+            yield self._running
+            return
         self.next_tid += 1
         tx = Transaction(self, self.next_tid)
+        self._running = tx
 
         try:
             yield tx
         finally:
-            print(f"Transaction {tx.tid} finished, committing")
-            self.commit(tx)
+            self._running = None
+            if tx.rejected:
+                # nothing of it has reached the disk; the owner drops what it built in memory
+                log.warning("Transaction %d does not fit in the journal, aborted", tx.tid)
+                if self.on_abort is not None:
+                    self.on_abort(tx)
+            else:
+                log.debug("Transaction %d finished, committing", tx.tid)
+                self.commit(tx)
 
     def commit(self, tx: Transaction):
         # if no write buffer, return
-        if not tx.write_buffer and not tx.ordered_data_blocks:
+        if not tx.slots and not tx.ordered_data_blocks and not tx.unsynced_data:
             return
         
         # JBD2
         if tx.ordered_data_blocks:
-            for block_addr in tx.ordered_data_blocks:
-                print(f"[Ordered Mode] Flushing {len(tx.ordered_data_blocks)} dependent data blocks...")
-                if self.page_cache.is_cached(block_addr):
-                    page = self.page_cache.get(block_addr)
-                    if page.dirty:
-                        self.disk.write_block(block_addr, bytes(page.data))
-                        page.dirty = False
-
-            self.disk.fsync()
+            log.debug("[Ordered Mode] Flushing %d dependent data blocks...", len(tx.ordered_data_blocks))
+            dirty = []
+            # ordered_data_blocks is already a set; sort it once so adjacent pages form runs
+            for block_addr in sorted(tx.ordered_data_blocks):
+                page = self.page_cache.get(block_addr)
+                if page is not None and page.dirty:
+                    dirty.append((block_addr, page.data))
+            self.disk.write_scattered(dirty)
+            for block_addr, _ in dirty:
+                self.page_cache.mark_clean(block_addr)
+
+            # one data-only barrier for the whole batch, and none if every page was already clean
+            # and none was written back on eviction in the meantime
+            if dirty or tx.unsynced_data or self.page_cache.unsynced:
+                self.disk.fdatasync()
+                self.page_cache.unsynced = False
+        elif tx.unsynced_data:
+            self.disk.fdatasync()
+            self.page_cache.unsynced = False
         
-        num_blocks = len(tx.write_buffer)
+        num_blocks = len(tx.slots)
+        # ascending final address, so the log and the checkpoint are written in disk order
+        items = tx.blocks()
+
+        # the span must not run into transactions whose checkpoint is not yet durable
+        used = (self.journal_sb.tail - self.journal_sb.head) % self.journal_sb.num_blocks
+        if used + num_blocks + 2 >= self.journal_sb.num_blocks:
+            self.sync_checkpoints()
 
         # descriptor block [header, num_blocks, final_block_addr[:]]
-        curr_block_no = self.journal_sb.tail
         desc_header = JournalHeader(magic=JOURNAL_MAGIC, block_type=JournalBlockType.BLOCK_TYPE_DESCRIPTOR.value, tid=tx.tid)
-        desc_block = DescriptorBlock(header=desc_header, num_blocks=num_blocks, final_block_addr=[key for key in tx.write_buffer])        
-        self.disk.write_block(curr_block_no, desc_block.pack().ljust(self.main_sb.block_size, b'\x00'))
+        desc_block = DescriptorBlock(header=desc_header, num_blocks=num_blocks, final_block_addr=array.array(ADDR_TYPECODE, [addr for addr, _ in items]))        
 
-        # data block
-        for final_block_addr in tx.write_buffer:
-            curr_block_no = self._get_next_log_block(curr_block_no)
-            block_type, block_data = tx.write_buffer[final_block_addr]
-            self.disk.write_block(curr_block_no, block_data)
-        
         # commit block
-        curr_block_no = self._get_next_log_block(curr_block_no)
         commit_header = JournalHeader(magic=JOURNAL_MAGIC, block_type=JournalBlockType.BLOCK_TYPE_COMMIT.value, tid=tx.tid)
         commit_block = CommitBlock(header=commit_header)
-        self.disk.write_block(curr_block_no, commit_block.pack().ljust(self.main_sb.block_size, b'\x00'))
 
-        # update superblock
-        curr_block_no = self._get_next_log_block(curr_block_no)
+        log_span = self._build_log(desc_block, items, commit_block)
+        curr_block_no = self._write_log(self.journal_sb.tail, log_span)
+        log_span.release()
+        if len(self._log_buf) > LOG_BUF_KEEP:
+            self._log_buf = bytearray(LOG_BUF_KEEP)
+
+        # update superblock (durable via O_DSYNC before home locations are touched)
         self.journal_sb.tail = curr_block_no
         self.journal_sb.last_tid = tx.tid
-        self.disk.write_block(self.main_sb.journal_area_start, self.journal_sb.pack().ljust(self.main_sb.block_size, b'\x00'))
+        self._write_journal_sb()
 
         # replay
-        for final_block_addr in tx.write_buffer:
-            block_type, block_data = tx.write_buffer[final_block_addr]
-            self.disk.write_block(final_block_addr, block_data)
+        self._checkpoint(items)
+        # cached copies of checkpointed blocks (inode table pages) must match the disk
+        for addr, block_data in items:
+            self.page_cache.refresh(addr, block_data)
+        # the log already holds this transaction durably, so the barrier that lets head
+        # advance is shared by every commit in the interval (group commit)
+        if time.monotonic() - self._last_checkpoint_sync >= CHECKPOINT_SYNC_INTERVAL:
+            self.sync_checkpoints()
+
+    def sync_checkpoints(self):
+        """
+        Make every checkpoint written so far durable and release its log space.
+        """
+        if self.journal_sb.head == self.journal_sb.tail:
+            return
+        # checkpointed blocks must be durable before the log is marked clean
+        self.disk.fdatasync()
 
         # update superblock
         self.journal_sb.head = self.journal_sb.tail
-        self.disk.write_block(self.main_sb.journal_area_start, self.journal_sb.pack().ljust(self.main_sb.block_size, b'\x00'))
+        self._write_journal_sb()
+        self._last_checkpoint_sync = time.monotonic()
+
+    def _build_log(self, desc_block: DescriptorBlock, items, commit_block: CommitBlock) -> memoryview:
+        """
+        Lay out descriptor + data blocks + commit block back to back in the reusable log buffer.
+        return: memoryview of the used span
+        """
+        bs = self.main_sb.block_size
+        total_blocks = len(items) + 2
+        if len(self._log_buf) < total_blocks * bs:
+            self._log_buf = bytearray(total_blocks * bs)
+        buf = self._log_buf
+
+        buf[0:bs] = self._zero_block
+        desc_block.pack_into(buf, 0)
+        for i, (_, block_data) in enumerate(items, 1):
+            buf[i * bs : (i + 1) * bs] = block_data
+        commit_off = (total_blocks - 1) * bs
+        buf[commit_off : commit_off + bs] = self._zero_block
+        commit_block.pack_into(buf, commit_off)
+
+        return memoryview(buf)[: total_blocks * bs]
+
+    def _write_log(self, start_block: int, log_span: memoryview) -> int:
+        """
+        Write log_span into the circular log area from start_block, splitting at the wrap point.
+        return: the log block following the last one written
+        """
+        bs = self.main_sb.block_size
+        total_blocks = len(log_span) // bs
+        first_len = min(total_blocks, self._log_end - start_block)
+        os.pwrite(self._journal_fd, log_span[: first_len * bs], start_block * bs)
+        if first_len < total_blocks:
+            os.pwrite(self._journal_fd, log_span[first_len * bs :], self._log_start * bs)
+            return self._log_start + total_blocks - first_len
+
+        end_block = start_block + total_blocks
+        return self._log_start if end_block >= self._log_end else end_block
+
+    def _prefetch_log(self, start_block: int, count: int):
+        first_len = min(count, self._log_end - start_block)
+        bs = self.main_sb.block_size
+        self.disk.prefetch(start_block * bs, first_len * bs)
+        if first_len < count:
+            self.disk.prefetch(self._log_start * bs, (count - first_len) * bs)
+
+    def _read_log(self, start_block: int, count: int) -> bytes:
+        """
+        Read count consecutive log blocks from start_block, following the wrap point.
+        """
+        first_len = min(count, self._log_end - start_block)
+        data = self.disk.read_blocks(start_block, first_len)
+        if first_len < count:
+            data += self.disk.read_blocks(self._log_start, count - first_len)
+        return data
+
+    def _checkpoint(self, items):
+        """
+        items: List[Tuple[int, bytes]] sorted by final block address
+        """
+        self.disk.write_scattered(items)
 
 
     def recover(self):
-        print("Starting journal recovery")
+        log.info("Starting journal recovery")
         head = self.journal_sb.head
         tail = self.journal_sb.tail
 
         if head == tail:
-            print("Journal is clean. No recovery needed.")
+            log.info("Journal is clean. No recovery needed.")
             return
         
+        # the scan range is known up front: a short log is prefetched whole, a long one
+        # through a readahead window that doubles as the scan catches up with it
+        bs = self.main_sb.block_size
+        scan_len = (tail - head) % self.journal_sb.num_blocks
+        ra_max = max(1, RECOVER_READAHEAD_MAX // bs)
+        ra_window = scan_len if scan_len <= ra_max else max(1, RECOVER_READAHEAD_MIN // bs)
+        ra_end = 0  # scan position (blocks past head) up to which readahead was issued
+
         curr_block_no = head
         transactions_to_replay = {}
 
         while curr_block_no != tail:
+            pos = (curr_block_no - head) % self.journal_sb.num_blocks
+            if pos >= ra_end - ra_window // 2 and ra_end < scan_len:
+                ra_end = max(ra_end, pos)
+                count = min(ra_window, scan_len - ra_end)
+                self._prefetch_log(self._log_start + (head - self._log_start + ra_end) % self.journal_sb.num_blocks, count)
+                ra_end += count
+                ra_window = min(ra_window * 2, ra_max)
             try:
                 data = self.disk.read_block(curr_block_no)
                 header = JournalHeader.unpack(data)
                 if header.block_type == JournalBlockType.BLOCK_TYPE_DESCRIPTOR.value:
-                    desc_block = DescriptorBlock.unpack(data)
-                    
-                    for final_addr in desc_block.final_block_addr:
-                        curr_block_no = self._get_next_log_block(curr_block_no)
-                        transactions_to_replay[desc_block.header.tid] = (final_addr, self.disk.read_block(curr_block_no))
+                    desc_block = DescriptorBlock.unpack(data, header)
+                    num_blocks = len(desc_block.final_block_addr)
+                    if num_blocks >= (tail - curr_block_no) % self.journal_sb.num_blocks:
+                        raise ValueError(f"descriptor for TID={header.tid} runs past the log tail")
+
+                    # the data blocks follow the descriptor back to back: one read, two if the log wraps
+                    first_block_no = self._get_next_log_block(curr_block_no)
+                    raw = memoryview(self._read_log(first_block_no, num_blocks))
+                    transactions_to_replay[header.tid] = [
+                        (final_addr, raw[i * bs : (i + 1) * bs]) for i, final_addr in enumerate(desc_block.final_block_addr)]
+                    # continue from the last data block
+                    curr_block_no = self._log_start + (curr_block_no - self._log_start + num_blocks) % self.journal_sb.num_blocks
 
                 elif header.block_type == JournalBlockType.BLOCK_TYPE_COMMIT.value:
                     commit_block = CommitBlock(header)
                     if commit_block.header.tid in transactions_to_replay:
-                        print(f"  - Found commit for TID={commit_block.header.tid}. Replaying transaction.")
-                        for final_addr, data in transactions_to_replay[commit_block.header.tid]:
-                            self.disk.write_block(final_addr, data)
-
-                        del transactions_to_replay[commit_block.header.tid]
+                        log.info("  - Found commit for TID=%d. Replaying transaction.", commit_block.header.tid)
+                        self._checkpoint(sorted(transactions_to_replay.pop(commit_block.header.tid), key=lambda item: item[0]))
                         self.journal_sb.head = self._get_next_log_block(curr_block_no)
 
             except (ValueError, struct.error) as e:
-                print(f"  - Error reading block {curr_block_no}: {e}. Stopping recovery scan.")
+                log.warning("  - Error reading block %d: %s. Stopping recovery scan.", curr_block_no, e)
                 break
 
             curr_block_no = self._get_next_log_block(curr_block_no)
         
-        print("Recovery finished. Cleaning journal by setting head = tail.")
+        # replayed blocks must be durable before the log is marked clean
+        self.disk.fdatasync()
+        log.info("Recovery finished. Cleaning journal by setting head = tail.")
         self.journal_sb.head = self.journal_sb.tail
-        self.disk.write_block(self.journal_area_start, self.journal_sb.pack().ljust(self.main_sb.block_size, b'\x00'))
\ No newline at end of file
+        self._write_journal_sb()
\ No newline at end of file
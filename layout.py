@@ -6,12 +6,30 @@ from transaction import Transaction
 from typing import Optional
 from enum import IntFlag
 import time
+import logging
+from itertools import accumulate
+from functools import lru_cache
+
+log = logging.getLogger(__name__)
 
 
 MAGIC = b"WAYNE_FS"
+# on-disk format, kept in the superblock's last field (0 in images from before it was recorded)
+#   1: inode records split into a hot prefix and the timestamps after it
+#   2: directory blocks stored as inode, name-length and name columns
+FORMAT_VERSION = 2
 SB_FMT = "<8sIIIIIIIIIIIII"
-SB_SIZE = struct.calcsize(SB_FMT)
+SB_STRUCT = struct.Struct(SB_FMT)
+SB_SIZE = SB_STRUCT.size
 INODE_SIZE = 128
+# hot fields (everything lookup needs) fill the first 64 bytes, timestamps follow
+INODE_HOT_FMT = "<IIQ12I"  # mode, nlink, size, direct[12]
+INODE_FMT = INODE_HOT_FMT + "QQQ"  # ..., ctime, mtime, atime
+INODE_HOT_STRUCT = struct.Struct(INODE_HOT_FMT)
+INODE_STRUCT = struct.Struct(INODE_FMT)
+# direct[12] as raw bytes: where a fast symlink keeps its target
+INODE_DIRECT_OFFSET = struct.calcsize("<IIQ")
+INODE_DIRECT_SIZE = 12 * 4
 
 class InodeMode(IntFlag):
     # 檔案型別（高位 bits）
@@ -36,6 +54,16 @@ class InodeMode(IntFlag):
     S_IWOTH = 0o002
     S_IXOTH = 0o001
 
+# plain-int file type bits for hot-path mode checks; IntFlag ops allocate a new member each time
+S_IFMT = int(InodeMode.S_IFMT)
+S_IFSOCK = int(InodeMode.S_IFSOCK)
+S_IFLNK = int(InodeMode.S_IFLNK)
+S_IFREG = int(InodeMode.S_IFREG)
+S_IFBLK = int(InodeMode.S_IFBLK)
+S_IFDIR = int(InodeMode.S_IFDIR)
+S_IFCHR = int(InodeMode.S_IFCHR)
+S_IFIFO = int(InodeMode.S_IFIFO)
+
 @dataclass
 class Inode:
     mode: int = 0  # 4
@@ -46,18 +74,11 @@ class Inode:
     atime: int = 0 # 8
     direct: list = field(default_factory=lambda: [0]*12)
 
-    def pack(self) -> bytearray:
-        data = bytearray()
-        data += struct.pack("<I", self.mode) 
-        data += struct.pack("<I", self.nlink)
-        data += struct.pack("<Q", self.size)
-        data += struct.pack("<Q", self.ctime)
-        data += struct.pack("<Q", self.mtime)
-        data += struct.pack("<Q", self.atime)
-        for idx in range(12):
-            data += struct.pack("<I", self.direct[idx])
+    def pack(self) -> bytes:
+        return INODE_STRUCT.pack(self.mode, self.nlink, self.size, *self.direct, self.ctime, self.mtime, self.atime)
 
-        return data
+    def pack_into(self, buf: bytearray, offset: int = 0):
+        INODE_STRUCT.pack_into(buf, offset, self.mode, self.nlink, self.size, *self.direct, self.ctime, self.mtime, self.atime)
 
     @classmethod
     def empty(cls, mode: int):
@@ -66,20 +87,30 @@ class Inode:
 
     @classmethod
     def unpack(cls, raw):
-        off = 0
-        mode = struct.unpack_from("<I", raw, off)[0]; off += 4
-        nlink = struct.unpack_from("<I", raw, off)[0]; off += 4
-        size = struct.unpack_from("<Q", raw, off)[0]; off += 8
-        ctime = struct.unpack_from("<Q", raw, off)[0]; off += 8
-        mtime = struct.unpack_from("<Q", raw, off)[0]; off += 8
-        atime = struct.unpack_from("<Q", raw, off)[0]; off += 8
-        direct = [0] * 12
-        for idx in range(12):
-            direct[idx] = struct.unpack_from("<I", raw, off)[0]; off += 4
+        fields = INODE_STRUCT.unpack_from(raw, 0)
+        mode, nlink, size = fields[:3]
+        direct = list(fields[3:15])
+        ctime, mtime, atime = fields[15:]
 
         return cls(mode, nlink, size, ctime, mtime, atime, direct)
 
 
+@dataclass
+class InodeHot:
+    """
+    Read-only view of the fields path lookup and permission checks touch.
+    """
+    mode: int
+    nlink: int
+    size: int
+    direct: list
+
+    @classmethod
+    def unpack(cls, raw):
+        fields = INODE_HOT_STRUCT.unpack_from(raw, 0)
+        return cls(fields[0], fields[1], fields[2], list(fields[3:]))
+
+
 @dataclass
 class Superblock:
     magic: int
@@ -100,14 +131,14 @@ class Superblock:
     journal_area_total_blocks: int
     # --- Data ---
     data_start: int
+    version: int = FORMAT_VERSION
 
     @classmethod
     def load(cls, disk: Disk):
         raw = disk.read_block(0)
-        fields = struct.unpack(SB_FMT, raw[:SB_SIZE])
-        magic = fields[0]
-        if magic != MAGIC:
+        if not raw.startswith(MAGIC):
             raise RuntimeError("Bad superblock magic; did you run mktoyfs.py?")
+        fields = SB_STRUCT.unpack_from(raw)
         ( magic,
           block_size,
           total_blocks,
@@ -121,141 +152,296 @@ class Superblock:
           journal_area_start,
           journal_area_total_blocks,
           data_start,
-          _reserved) = fields
+          version) = fields
+        if version != FORMAT_VERSION:
+            raise RuntimeError(f"Unsupported on-disk format version {version} (expected {FORMAT_VERSION}); recreate the image with mkwaynefs.py")
         disk.block_size = block_size  # sync disk view
         return cls(magic, block_size, total_blocks, inode_count,
                    inode_bitmap_start, inode_bitmap_blocks,
                    block_bitmap_start, block_bitmap_blocks,
                    inode_table_start, inode_table_blocks,
                    journal_area_start, journal_area_total_blocks,
-                   data_start)
+                   data_start, version)
+
+    def pack_into(self, buf, offset: int = 0):
+        SB_STRUCT.pack_into(buf, offset, self.magic, self.block_size, self.total_blocks, self.inode_count,
+                            self.inode_bitmap_start, self.inode_bitmap_blocks,
+                            self.block_bitmap_start, self.block_bitmap_blocks,
+                            self.inode_table_start, self.inode_table_blocks,
+                            self.journal_area_start, self.journal_area_total_blocks,
+                            self.data_start,
+                            self.version)
       
+DIR_COUNT_STRUCT = struct.Struct("<I")
+
+
+@lru_cache(maxsize=256)
+def _dir_header_struct(count: int) -> struct.Struct:
+    # directory header for `count` entries: count, inos, name lengths
+    return struct.Struct(f"<I{count}I{count}H")
+
+
 class DictEnDecoder:
+    # layout: [count u32][ino u32 * count][name_length u16 * count][names back to back]
+    # so a name scan only touches the length array and the name heap
     def pack_dir(entries):
         """
         entries: List[Tuple[int, str]]  e.g. [(0, "."), (0, "..")]
         return: bytes
         """
-        data = bytearray()
-        for ino, name in entries:
-            name_b = name.encode("utf-8")
-            # Packed：ino, name_length, name
-            entry_packed = struct.pack(f"<IH{len(name_b)}s", ino, len(name_b), name_b)
-            data.extend(entry_packed)
-        
-        # Add all length
-        header = struct.pack("<I", len(data))
-        
-        # DEBUG print
-        #print(f"[pack_dir] Total entries: {len(entries)}. Total data length: {len(data)}. Packed size: {len(header) + len(data)}")
-        
-        return bytes(header + data)
+        names = [name.encode("utf-8") for _, name in entries]
+        count = len(names)
+        header = _dir_header_struct(count).pack(count, *(ino for ino, _ in entries), *(len(name_b) for name_b in names))
+
+        # one join builds the block image; the caller's page absorbs the zero tail
+        return b"".join([header, *names])
 
     @staticmethod
-    def unpack_dir(raw: bytes) -> list[tuple[int, str]]:
+    def _unpack_columns(raw: bytes):
         """
-        raw: bytes of a directory file
-        return: List[Tuple[int, str]]
+        return: (inos, name_lengths, name_heap_offset), or None if raw is malformed
         """
-        #print("\n--- [unpack_dir] Starting Directory Unpack ---")
         if not raw or len(raw) < 4:
-            #print("[unpack_dir] Error: Raw data is empty or too short for header.")
-            return []
+            log.debug("unpack_dir: raw data is empty or too short for header")
+            return None
+
+        count, = DIR_COUNT_STRUCT.unpack_from(raw, 0)
+        heap_off = 4 + count * 6
+        if heap_off > len(raw):
+            log.debug("unpack_dir: %d entries do not fit in %d bytes", count, len(raw))
+            return None
+
+        # count, both columns in one call
+        fields = _dir_header_struct(count).unpack_from(raw, 0)
+        return fields[1 : 1 + count], fields[1 + count :], heap_off
 
+    @staticmethod
+    def _decode_names(raw: bytes, nlens, offset: int) -> Optional[list]:
+        """
+        return: every name of a well-formed block, or None to fall back to the checked walk
+        """
+        bounds = list(accumulate(nlens, initial=0))
+        end = offset + bounds[-1]
+        if end > len(raw):
+            return None
         try:
-            # 1. Read all data length
-            total_len, = struct.unpack_from("<I", raw, 0)
-            #print(f"[unpack_dir] Header reports total data length: {total_len} bytes.")
-            
-            if total_len == 0:
-                #print("[unpack_dir] Header reports zero length. Directory is empty.")
-                return []
-            
-            # 2. Data handle
-            effective_data_end = 4 + total_len
-            if effective_data_end > len(raw):
-                #print(f"[unpack_dir] Warning: Reported length ({total_len}) is greater than available raw data ({len(raw)-4}). Truncating.")
-                effective_data_end = len(raw)
-
-            data_slice = raw[4:effective_data_end]
-            #print(f"[unpack_dir] Sliced effective data of length: {len(data_slice)} bytes.")
-
-        except struct.error as e:
-            #print(f"[unpack_dir] Error reading header: {e}")
+            # str(buf, "utf-8") decodes views as well as bytes
+            heap = str(raw[offset:end], "utf-8")
+            if len(heap) == end - offset:
+                # an ASCII heap: byte offsets are character offsets, so one decode serves all
+                # names and each is a str slice
+                return [heap[lo:hi] for lo, hi in zip(bounds, bounds[1:])]
+            return [str(raw[offset + lo : offset + hi], "utf-8") for lo, hi in zip(bounds, bounds[1:])]
+        except UnicodeDecodeError:
+            return None
+
+    @staticmethod
+    def unpack_names(raw: bytes) -> dict[str, int]:
+        """
+        raw: bytes of a directory file, or a view of its cached page
+        return: {name: ino}, in entry order
+        """
+        columns = DictEnDecoder._unpack_columns(raw)
+        if columns is None:
+            return {}
+        inos, nlens, offset = columns
+        names = DictEnDecoder._decode_names(raw, nlens, offset)
+        if names is not None:
+            return dict(zip(names, inos))
+        return {name: ino for ino, name in DictEnDecoder.unpack_dir(raw)}
+
+    @staticmethod
+    def unpack_dir(raw: bytes) -> list[tuple[int, str]]:
+        """
+        raw: bytes of a directory file, or a view of its cached page
+        return: List[Tuple[int, str]]
+        """
+        columns = DictEnDecoder._unpack_columns(raw)
+        if columns is None:
             return []
+        inos, nlens, offset = columns
 
+        # fast path: well-formed blocks decode in one pass over precomputed offsets
+        names = DictEnDecoder._decode_names(raw, nlens, offset)
+        if names is not None:
+            return list(zip(inos, names))
 
+        # otherwise keep the entries before the first bad one
         out = []
-        offset = 0
-        entry_count = 1
-        while offset < len(data_slice):
-            #print(f"\n[unpack_dir] --- Parsing Entry #{entry_count} at offset {offset} ---")
+        for ino, nlen in zip(inos, nlens):
+            if offset + nlen > len(raw):
+                log.debug("unpack_dir: name length %d exceeds remaining data", nlen)
+                break
             try:
-                header_size = struct.calcsize("<IH") # 6 bytes
-                if offset + header_size > len(data_slice):
-                    #print(f"[unpack_dir] Error: Not enough data left for entry header. Remaining: {len(data_slice)-offset} bytes.")
-                    break
-
-                # 3. Read (inode, name length)
-                ino, nlen = struct.unpack_from("<IH", data_slice, offset)
-                #print(f"[unpack_dir] Entry Header: ino={ino}, name_length={nlen}")
-                
-                # 4. Check valid
-                if offset + header_size + nlen > len(data_slice):
-                    #print(f"[unpack_dir] Error: Name length ({nlen}) exceeds remaining data boundary.")
-                    break
-
-                # 5. Read file name
-                name_bytes, = struct.unpack_from(f"<{nlen}s", data_slice, offset + header_size)
-                name = name_bytes.decode("utf-8")
-                #print(f"[unpack_dir] Entry Data: name='{name}'")
-                
-                out.append((ino, name))
-                
-                # 6. Move next
-                offset += header_size + nlen
-                entry_count += 1
-                
-            except (struct.error, UnicodeDecodeError) as e:
-                #print(f"[unpack_dir] CRITICAL ERROR during entry parsing: {e}. Aborting.")
+                name = str(raw[offset : offset + nlen], "utf-8")
+            except UnicodeDecodeError as e:
+                log.debug("unpack_dir: error while decoding name at offset %d: %s", offset, e)
                 break
-        
-        #print(f"--- [unpack_dir] Finished Unpack. Found {len(out)} entries: {out} ---\n")
+            out.append((ino, name))
+            offset += nlen
+
         return out
 
+    @staticmethod
+    def append_entry(raw: bytes, ino: int, name: str) -> Optional[bytes]:
+        """
+        raw: bytes of a directory file
+        return: the directory with (ino, name) added last, or None if raw is malformed;
+        the other names are copied as one heap slice, not decoded and re-encoded
+        """
+        columns = DictEnDecoder._unpack_columns(raw)
+        if columns is None:
+            return None
+        inos, nlens, offset = columns
+        heap_end = offset + sum(nlens)
+        if heap_end > len(raw):
+            return None
+
+        name_b = name.encode("utf-8")
+        count = len(inos) + 1
+        header = _dir_header_struct(count).pack(count, *inos, ino, *nlens, len(name_b))
+        return b"".join([header, raw[offset:heap_end], name_b])
+
+    @staticmethod
+    def remove_entry(raw: bytes, name: str) -> Optional[bytes]:
+        """
+        raw: bytes of a directory file
+        return: the directory without the entry called name, or None if it is absent or raw is malformed
+        """
+        found = DictEnDecoder._find_entry(raw, name)
+        if found is None:
+            return None
+        inos, nlens, offset, heap_end, i, lo, hi = found
+
+        # drop column slot i and cut the name out of the heap
+        count = len(inos) - 1
+        header = _dir_header_struct(count).pack(count, *inos[:i], *inos[i + 1:], *nlens[:i], *nlens[i + 1:])
+        return b"".join([header, raw[offset:lo], raw[hi:heap_end]])
+
+    @staticmethod
+    def replace_entry(raw: bytes, name: str, ino: int, new_name: str) -> Optional[bytes]:
+        """
+        raw: bytes of a directory file
+        return: the directory with the entry called name turned into (ino, new_name) in the same slot,
+        or None if it is absent or raw is malformed
+        """
+        found = DictEnDecoder._find_entry(raw, name)
+        if found is None:
+            return None
+        inos, nlens, offset, heap_end, i, lo, hi = found
+
+        # the heap keeps every other name as is; an unchanged name is not re-encoded either
+        new_name_b = raw[lo:hi] if new_name == name else new_name.encode("utf-8")
+        inos, nlens = list(inos), list(nlens)
+        inos[i], nlens[i] = ino, len(new_name_b)
+        header = _dir_header_struct(len(inos)).pack(len(inos), *inos, *nlens)
+        return b"".join([header, raw[offset:lo], new_name_b, raw[hi:heap_end]])
+
+    @staticmethod
+    def _find_entry(raw: bytes, name: str):
+        """
+        return: (inos, nlens, heap offset, heap end, slot, name start, name end) of the entry
+        called name, or None if it is absent or raw is malformed
+        """
+        columns = DictEnDecoder._unpack_columns(raw)
+        if columns is None:
+            return None
+        inos, nlens, offset = columns
+        heap_end = offset + sum(nlens)
+        if heap_end > len(raw):
+            return None
+
+        name_b = name.encode("utf-8")
+        want = len(name_b)
+        lo = offset
+        for i, nlen in enumerate(nlens):
+            if nlen == want and raw[lo : lo + nlen] == name_b:
+                return inos, nlens, offset, heap_end, i, lo, lo + want
+            lo += nlen
+        return None
+
 class InodeTable:
-    def __init__(self, disk: Disk, sb: Superblock, inode_size: int = 128):
+    def __init__(self, disk: Disk, sb: Superblock, inode_size: int = 128, page_cache=None):
+        """
+        page_cache: optional PageCache that keeps inode table blocks in memory
+        """
         self.disk = disk
         self.sb = sb
         self.inode_size = inode_size
         self.inodes_per_block = self.sb.block_size // inode_size
+        self._inode_pad = bytes(inode_size - INODE_STRUCT.size)
+        self.page_cache = page_cache
         
     def __inode_offset(self, idx: int) -> int:
         return self.sb.inode_table_start * self.sb.block_size + idx * self.inode_size
 
+    def __locate(self, ino: int):
+        """
+        return: (block_addr, offset_in_block)
+        """
+        blk, slot = divmod(ino, self.inodes_per_block)
+        return self.sb.inode_table_start + blk, slot * self.inode_size
+
+    def __cached_block(self, block_addr: int):
+        # inode table pages stay clean: updates reach the disk through the journal,
+        # the cached copy is only kept in step with what the journal will write
+        return self.page_cache.load(block_addr).data
+
     def read(self, ino: int) -> Inode:
+        if self.page_cache is not None:
+            block_addr, off = self.__locate(ino)
+            return Inode.unpack(self.__cached_block(block_addr)[off : off + self.inode_size])
         off = self.__inode_offset(ino)
         raw = self.disk.read_at(off, self.inode_size)
         return Inode.unpack(raw)
 
-    def write(self, ino: int, inode: Inode, tx: Optional[Transaction] = None):
-        block_addr = self.sb.inode_table_start + (ino // self.inodes_per_block)
-        offset_in_block = (ino % self.inodes_per_block) * self.inode_size
+    def read_hot(self, ino: int) -> InodeHot:
+        if self.page_cache is not None:
+            block_addr, off = self.__locate(ino)
+            return InodeHot.unpack(self.__cached_block(block_addr)[off : off + INODE_HOT_STRUCT.size])
+        off = self.__inode_offset(ino)
+        raw = self.disk.read_at(off, INODE_HOT_STRUCT.size)
+        return InodeHot.unpack(raw)
 
-        if tx and block_addr in tx.write_buffer:
-            _block_type, block_data = tx.write_buffer[block_addr]
-            full_block_data = bytearray(block_data)
-        else:
-            full_block_data = bytearray(self.disk.read_block(block_addr))
+    def read_inline(self, ino: int, length: int) -> bytes:
+        """
+        return: the first length bytes of the inode's direct[] area, as stored; no pointer decoding
+        """
+        length = min(length, INODE_DIRECT_SIZE)
+        if self.page_cache is not None:
+            block_addr, off = self.__locate(ino)
+            off += INODE_DIRECT_OFFSET
+            return bytes(self.__cached_block(block_addr)[off : off + length])
+        return self.disk.read_at(self.__inode_offset(ino) + INODE_DIRECT_OFFSET, length)
+
+    def __pack_slot(self, buf, offset: int, inode: Inode):
+        inode.pack_into(buf, offset)
+        buf[offset + INODE_STRUCT.size : offset + self.inode_size] = self._inode_pad
+
+    def write(self, ino: int, inode: Inode, tx: Optional[Transaction] = None):
+        block_addr, offset_in_block = self.__locate(ino)
+        cached = self.page_cache is not None and self.page_cache.is_cached(block_addr)
 
         if tx:
-            full_block_data[offset_in_block : offset_in_block + self.inode_size] = inode.pack().ljust(self.inode_size, b'\x00')
-            print(f"[Debug] Inode Table block addr = {block_addr} off = {offset_in_block} ino = {ino}")
-            tx.write(block_addr, bytes(full_block_data), "Inode Table")
+            # the block is logged once per transaction; later inodes in the same
+            # block are packed straight into its copy in the transaction arena
+            base = tx.arena_offset(block_addr)
+            if base is None:
+                if self.page_cache is not None:
+                    block_data = self.__cached_block(block_addr)
+                    cached = True
+                else:
+                    block_data = self.disk.read_block(block_addr)
+                tx.write(block_addr, block_data, "Inode Table")
+                base = tx.arena_offset(block_addr)
+            self.__pack_slot(tx.arena, base + offset_in_block, inode)
         else:
             off = self.__inode_offset(ino)
             self.disk.write_at(off, inode.pack())
 
+        if cached:
+            self.__pack_slot(self.page_cache.get(block_addr).data, offset_in_block, inode)
+
 @dataclass
 class OpenFileState:
     ino: int
@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
-import struct, argparse
-from journal import JournalSuperblock, JOURNAL_SB_MAGIC
-from layout import MAGIC, SB_FMT, SB_SIZE, INODE_SIZE, Superblock, DictEnDecoder, Inode, InodeMode, InodeTable, ceil_div
+import os, argparse
+from journal import JournalSuperblock, JOURNAL_SB_MAGIC, DEFAULT_JOURNAL_BLOCKS, min_journal_area_blocks
+from layout import MAGIC, FORMAT_VERSION, INODE_SIZE, Superblock, DictEnDecoder, Inode, InodeMode, ceil_div
 from disk import Disk
 from bitmap import InodeBitmap, BlockBitmap
 
 ROOT_INO = 0 
 
-def make_image(path, size_mb, block_size, inode_count, journal_size):
+def make_image(path, size_mb, block_size, inode_count, journal_size=None):
     total_blocks = (size_mb * 1024 * 1024) // block_size
     if total_blocks < 1024:
         raise SystemExit("Image too small; give at least ~4MB")
@@ -34,67 +34,55 @@ def make_image(path, size_mb, block_size, inode_count, journal_size):
     inode_table_start  = block_bitmap_start + block_bitmap_blocks
 
     journal_area_start = inode_table_start + inode_blocks
-    journal_area_blocks = ceil_div(journal_size, block_size)
+    # the log must hold the largest transaction an operation builds; that grows with the bitmaps,
+    # so without an explicit size the default is raised to fit, and only a given size is refused
+    min_journal_blocks = min_journal_area_blocks(inode_bitmap_blocks, block_bitmap_blocks, inode_blocks)
+    if journal_size is None:
+        journal_area_blocks = max(DEFAULT_JOURNAL_BLOCKS, min_journal_blocks)
+    else:
+        journal_area_blocks = ceil_div(journal_size, block_size)
+        if journal_area_blocks < min_journal_blocks:
+            raise SystemExit(f"Journal too small; give at least {min_journal_blocks} blocks")
 
     data_start         = journal_area_start + journal_area_blocks
 
     if data_start >= total_blocks:
         raise SystemExit("Layout exceeds image size; increase size or reduce inode_count")
 
-    with open(path, "wb") as f:
-        f.truncate(total_blocks * block_size)
+    # one descriptor for the whole build: O_TRUNC empties any old image, so every
+    # region starts out zeroed, then the extents are allocated up front
+    disk = Disk(path, block_size, os.O_CREAT | os.O_TRUNC)
+    disk.fallocate(0, total_blocks * block_size)
+
+    sb = Superblock(MAGIC, block_size, total_blocks, inode_count,
+                    inode_bitmap_start, inode_bitmap_blocks,
+                    block_bitmap_start, block_bitmap_blocks,
+                    inode_table_start, inode_blocks,
+                    journal_area_start, journal_area_blocks,
+                    data_start, FORMAT_VERSION)
+
+    # every metadata block up to and including the root directory block is built
+    # in this buffer and written with one pwrite
+    root_blk = sb.data_start
+    meta = bytearray((root_blk + 1) * block_size)
+
+    # Superblock
+    sb.pack_into(meta, 0)
 
-    
-    # Write superblock
-    with open(path, "r+b") as f:
-        sb = struct.pack(
-            SB_FMT,
-            MAGIC,
-            block_size,
-            total_blocks,
-            inode_count,
-            inode_bitmap_start,
-            inode_bitmap_blocks,
-            block_bitmap_start,
-            block_bitmap_blocks,
-            inode_table_start,
-            inode_blocks,
-            journal_area_start,
-            journal_area_blocks,
-            data_start,
-            0,  # reserved
-        )
-        f.seek(0)
-        f.write(sb)
-        f.write(b"\x00" * (block_size - SB_SIZE))
-
-        f.seek(inode_bitmap_start * block_size)
-        f.write(b"\x00" * (inode_bitmap_blocks * block_size))
-
-        f.seek(block_bitmap_start * block_size)
-        f.write(b"\x00" * (block_bitmap_blocks * block_size))
-        f.seek(inode_table_start * block_size)
-        f.write(b"\x00" * (inode_blocks * block_size))
-
-
-    disk = Disk(path)
-    sb = Superblock.load(disk)
     inode_bitmap = InodeBitmap(disk, sb) 
     block_bitmap = BlockBitmap(disk, sb)
-    inode_table = InodeTable(disk, sb)
 
     # write first two node in data start
-    root_blk = sb.data_start
     root_entries = [(0, "."), (0, "..")]
     raw_data = DictEnDecoder.pack_dir(root_entries)
-    disk.write_block(root_blk, raw_data + b"\x00" * (sb.block_size - len(raw_data)))
+    meta[root_blk * block_size : root_blk * block_size + len(raw_data)] = raw_data
 
     # write root inode into indoe table
     root_inode = Inode.empty(mode=InodeMode.S_IFDIR)
     root_inode.nlink = 2
     root_inode.size  = len(raw_data)
     root_inode.direct[0] = sb.data_start
-    inode_table.write(ROOT_INO, root_inode)
+    root_inode.pack_into(meta, inode_table_start * block_size + ROOT_INO * INODE_SIZE)
     
     # Journal Superblock
     log_start_block = journal_area_start + 1
@@ -108,20 +96,23 @@ def make_image(path, size_mb, block_size, inode_count, journal_size):
         tail=log_start_block,
         last_tid=0             # 初始 TID 為 0
     )
-
-    raw_jsb = initial_journal_sb.pack()
-    disk.write_block(journal_area_start, raw_jsb.ljust(sb.block_size, b'\x00'))
+    initial_journal_sb.pack_into(meta, journal_area_start * block_size)
     
     inode_bitmap.set_used(ROOT_INO)
-    inode_bitmap.flush()
 
     # update the valid bitmap
-    # set used for all blk before data_start 
-    for ino in range(root_blk + 1):
-        block_bitmap.set_used(ino)
-    # set root data is used
-    block_bitmap.flush()
+    # set used for all blk before data_start, and the root data block
+    block_bitmap.set_range_used(0, root_blk)
+
+    # the bitmaps work on private mappings of the zeroed image; copy their bits in
+    meta[inode_bitmap_start * block_size : inode_bitmap_start * block_size + len(inode_bitmap.buf)] = inode_bitmap.buf
+    meta[block_bitmap_start * block_size : block_bitmap_start * block_size + len(block_bitmap.buf)] = block_bitmap.buf
+
+    disk.write_at(0, meta)
     disk.fsync()
+    # the metadata is durable now; do not leave it occupying the page cache
+    disk.drop_cache(0, len(meta))
+    disk.close()
 
     print(f"Created image: {path}")
     print("=" * 50)
@@ -140,7 +131,7 @@ def main():
     ap.add_argument("--size-mb", type=int, default=128)
     ap.add_argument("--block-size", type=int, default=4096)
     ap.add_argument("--inodes", type=int, default=1024)
-    ap.add_argument("--journal-size", type=int, default=10*4096)
+    ap.add_argument("--journal-size", type=int, default=None, help="bytes; sized from the geometry if omitted")
     args = ap.parse_args()
     make_image(args.image, args.size_mb, args.block_size, args.inodes, args.journal_size)
 
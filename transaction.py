@@ -1,20 +1,82 @@
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple
 import typing
+import errno
+import logging
 if typing.TYPE_CHECKING:
     from journal import Journal
 
+log = logging.getLogger(__name__)
+
 class Transaction:
     def __init__(self, journal: "Journal", tid: int):
         self.journal = journal
         self.tid = tid
-        self.write_buffer: Dict[int, Tuple[str, bytes]] = {} 
+        # one column per field, indexed by arena slot: block data back to back in the arena,
+        # final addresses and types in parallel lists; slots maps final addr -> arena slot
+        self.block_size = journal.main_sb.block_size
+        self.arena = bytearray()
+        self.addrs: List[int] = []
+        self.block_types: List[str] = []
+        self.slots: Dict[int, int] = {}
         self.ordered_data_blocks = set()
-        print(f"Transaction {self.tid} started.")
+        # data already written to the disk behind the page cache, still to be made durable
+        self.unsynced_data = False
+        # set once a block is refused for lack of log space; the transaction is then never committed
+        self.rejected = False
+        log.debug("Transaction %d started.", self.tid)
     
     def add_data_dependency(self, block_addr: int):
         self.ordered_data_blocks.add(block_addr)
 
+    def add_unsynced_data(self):
+        """
+        Order data written straight to the disk before this commit; its barrier is shared with
+        the flush of the dependent pages.
+        """
+        self.unsynced_data = True
+
     def write(self, final_block_addr: int, block_data: bytes, block_type: str = "Unknown"):
-        print(f"  - tx {self.tid}: logging write for '{block_type}' to block {final_block_addr}")
-        assert len(block_data) == self.journal.main_sb.block_size
-        self.write_buffer[final_block_addr] = (block_type, block_data)
\ No newline at end of file
+        log.debug("tx %d: logging write for '%s' to block %d", self.tid, block_type, final_block_addr)
+        bs = self.block_size
+        assert len(block_data) == bs
+        slot = self.slots.get(final_block_addr)
+        if slot is None:
+            # refused before the caller patches anything: the log cannot hold one more block
+            if len(self.addrs) >= self.journal.max_tx_blocks:
+                self.rejected = True
+                raise OSError(errno.ENOSPC, "Transaction does not fit in the journal")
+            self.slots[final_block_addr] = len(self.addrs)
+            self.addrs.append(final_block_addr)
+            self.block_types.append(block_type)
+            self.arena += block_data
+        else:
+            self.block_types[slot] = block_type
+            self.arena[slot * bs : (slot + 1) * bs] = block_data
+
+    def arena_offset(self, final_block_addr: int) -> Optional[int]:
+        """
+        return: where the block logged for final_block_addr starts in the arena, or None;
+        callers may patch it in place until commit
+        """
+        slot = self.slots.get(final_block_addr)
+        if slot is None:
+            return None
+        return slot * self.block_size
+
+    def read(self, final_block_addr: int) -> Optional[bytes]:
+        """
+        return: the block already logged for final_block_addr, or None
+        """
+        slot = self.slots.get(final_block_addr)
+        if slot is None:
+            return None
+        return bytes(self.arena[slot * self.block_size : (slot + 1) * self.block_size])
+
+    def blocks(self) -> List[Tuple[int, memoryview]]:
+        """
+        return: [(final_addr, block view into the arena)] in ascending address order
+        """
+        bs = self.block_size
+        arena = memoryview(self.arena)
+        addrs = self.addrs
+        return [(addrs[slot], arena[slot * bs : (slot + 1) * bs]) for slot in sorted(range(len(addrs)), key=addrs.__getitem__)]
@@ -1,86 +1,250 @@
 #!/usr/bin/env python3
-import os, errno, time, argparse
+import os, errno, time, argparse, logging, threading, functools
 from fuse import FUSE, Operations, LoggingMixIn
 from disk import Disk
 from bitmap import InodeBitmap, BlockBitmap
-from layout import Superblock, DictEnDecoder, Inode, InodeMode, InodeTable, OpenFileState, ceil_div
+from layout import Superblock, DictEnDecoder, Inode, InodeTable, OpenFileState, ceil_div, S_IFMT, S_IFDIR, S_IFLNK, S_IFREG
 from journal import Journal
-from cache import PageCache, DentryCache
-from typing import List, Tuple, Dict
+from transaction import Transaction
+from cache import PageCache, DentryCache, DirCache, AttrCache, InodeCache
+from typing import List, Tuple, Dict, Optional
 import struct
 
+log = logging.getLogger(__name__)
+
 ROOT_INO = 0 
+# largest write the kernel may hand us in one call (libfuse 2 defaults to 4 KiB without big_writes)
+MAX_WRITE = 128 * 1024
+PTR_STRUCT = struct.Struct("<I")  # one block pointer in an indirect block
+DIRECT_STRUCT = struct.Struct("<12I")  # inode.direct[], or the inline target of a fast symlink
+# relatime: an access older than this is recorded even if the file has not changed since
+RELATIME_INTERVAL = 24 * 3600
+
+@functools.lru_cache(maxsize=None)
+def ptrs_struct(count: int) -> struct.Struct:
+    # count consecutive block pointers; at most one block's worth, so the cache stays small
+    return struct.Struct(f"<{count}I")
+
 
 class WayneFS(LoggingMixIn, Operations):
     def __init__(self, image_path):
         self.disk = Disk(image_path)
         self.sb = Superblock.load(self.disk)
+        # superblock geometry never changes after mount; plain attributes for the hot paths
+        self._bs = self.sb.block_size
+        self._data_start = self.sb.data_start
+
+        # Journal: committed transactions whose checkpoint may not have reached the disk are
+        # replayed before anything reads the metadata, above all before the bitmaps map it.
+        # The journal only needs the page cache for later commits.
+        self.page_cache = PageCache(self.disk)
+        self.journal = Journal(self.disk, self.sb, self.page_cache)
+        self.journal.recover()
+
         self.inode_bitmap = InodeBitmap(self.disk, self.sb)
         self.block_bitmap = BlockBitmap(self.disk, self.sb)
-        self.inode_table = InodeTable(self.disk, self.sb)
+        # blocks claimed as one contiguous run for the current write/extend, next block last
+        self._reserved: List[int] = []
+        # shared source of zero bytes for new blocks and short-block padding
+        self._zero_block = bytes(self._bs)
+        self._zero_view = memoryview(self._zero_block)
+        # scratch for a fast symlink's target, zero-padded to the size of direct[]
+        self._inline_buf = bytearray(DIRECT_STRUCT.size)
 
         # Cache
-        self.page_cache = PageCache()
         self.dentry_cache = DentryCache()
+        self.dir_cache = DirCache()
+        self.attr_cache = AttrCache()
+        self.inode_cache = InodeCache()
+        self.inode_table = InodeTable(self.disk, self.sb, page_cache=self.page_cache)
+        self.journal.on_abort = self._abort_tx
         self.start = time.time()
 
-        # Journal
-        self.journal = Journal(self.disk, self.sb, self.page_cache)
-
         # Open File Table
         self.open_file_table: Dict[int, OpenFileState] = {}  # {fh(int): OpenFileState}
         self.next_fh = 0
 
-        ADDRS_PER_BLOCK = self.sb.block_size // 4
+        # fusepy runs operations on several threads; the caches, bitmaps and journal are shared
+        self._op_lock = threading.RLock()
+
+        ADDRS_PER_BLOCK = self._bs // 4
         self.MAX_BLOCKS = 10 + ADDRS_PER_BLOCK + (ADDRS_PER_BLOCK * ADDRS_PER_BLOCK)
 
     # --- helpers ---
     def _iget(self, ino: int) -> Inode:
-        return self.inode_table.read(ino)
+        # every operation starts from a lookup and an _iget, the root's most of all: decode each
+        # inode once. Callers share the object, so it is only modified on the way to _iput
+        inode = self.inode_cache.get(ino)
+        if inode is None:
+            inode = self.inode_table.read(ino)
+            self.inode_cache.put(ino, inode)
+        return inode
+
+    def _iget_hot(self, ino: int):
+        # the fields a path walk reads: an inode decoded earlier serves as is,
+        # otherwise only the hot prefix is unpacked, and not cached
+        inode = self.inode_cache.get(ino)
+        return inode if inode is not None else self.inode_table.read_hot(ino)
+
+    def _iput(self, ino: int, inode: Inode, tx: Optional[Transaction] = None):
+        # every inode update goes through here, so cached attributes are never stale
+        self.attr_cache.remove(ino)
+        self.inode_cache.put(ino, inode)
+        self.inode_table.write(ino, inode, tx)
     
+    def _abort_tx(self, tx: Transaction):
+        # the journal refused the transaction, so the disk still holds the last commit: drop
+        # what the operation changed in memory and let everything reload from there. Its data
+        # pages are the dirty ones, its inode table pages were patched while being logged
+        for block_addr, _ in self.page_cache.get_dirty_pages():
+            self.page_cache.discard(block_addr)
+        for block_addr in tx.addrs:
+            self.page_cache.discard(block_addr)
+        self.inode_bitmap.reload()
+        self.block_bitmap.reload()
+        self.inode_cache.clear()
+        self.attr_cache.clear()
+        self.dentry_cache.clear()
+        self.dir_cache.clear()
+
     def _read_dir_entries(self, curr_inode: Inode):
         """
         curr_inode: Inode obj
         return: List[Tuple[int, str]]
         """
+        # names within a directory are unique and the dict keeps the on-disk order,
+        # so the decoded map gives back the entry list without touching the block
+        return [(child_ino, child_name) for child_name, child_ino in self._dir_names(curr_inode).items()]
+
+    def _dir_names(self, curr_inode: Inode) -> Dict[str, int]:
+        """
+        curr_inode: Inode obj of a directory
+        return: {name: ino} of its entries, shared with the dir cache; only the entry helpers modify it
+        """
         blk_offset = curr_inode.direct[0]
-        raw = self._read_block_cached(blk_offset)
-        return DictEnDecoder.unpack_dir(raw)
+        names = self.dir_cache.get(blk_offset)
+        if names is None:
+            # decoded straight from the cached page, no block-sized copy first
+            raw = self.page_cache.load(blk_offset).data
+            names = DictEnDecoder.unpack_names(raw)
+            self.dir_cache.put(blk_offset, names)
+        return names
+
+    def _find_dir_entry(self, curr_inode: Inode, name: str) -> Optional[int]:
+        """
+        curr_inode: Inode obj of a directory
+        return: ino of the child called name, or None
+        """
+        return self._dir_names(curr_inode).get(name)
     
     def _write_dir_entries(self, curr_inode: Inode,  entries: List[Tuple[str, int]], touched_data_blocks: List[int]):
         """
         curr_inode: Inode obj
         entries: List[Tuple[int, str]]  e.g. [(0, "."), (0, "..")]
         """
-        raw_data = DictEnDecoder.pack_dir(entries)
-        if len(raw_data) > self.sb.block_size:
+        # the entries just written are the new decoded directory
+        self._store_dir(curr_inode, DictEnDecoder.pack_dir(entries),
+                        {child_name: child_ino for child_ino, child_name in entries}, touched_data_blocks)
+
+    def _add_dir_entry(self, curr_inode: Inode, child_ino: int, child_name: str, touched_data_blocks: List[int]):
+        """
+        Append one entry to a directory; the other names are carried over as bytes, not repacked.
+        """
+        raw_data = DictEnDecoder.append_entry(self._dir_raw(curr_inode), child_ino, child_name)
+        if raw_data is None:
+            entries = self._read_dir_entries(curr_inode)
+            entries.append((child_ino, child_name))
+            return self._write_dir_entries(curr_inode, entries, touched_data_blocks)
+
+        # the cached map is edited in place once the block is stored: a copy per new entry
+        # would make filling a directory quadratic
+        names = self.dir_cache.get(curr_inode.direct[0])
+        self._store_dir(curr_inode, raw_data, names, touched_data_blocks)
+        if names is not None:
+            names[child_name] = child_ino
+
+    def _remove_dir_entry(self, curr_inode: Inode, child_name: str, touched_data_blocks: List[int]):
+        """
+        Drop the entry called child_name from a directory without repacking the others.
+        """
+        raw_data = DictEnDecoder.remove_entry(self._dir_raw(curr_inode), child_name)
+        if raw_data is None:
+            raise OSError(errno.ENOENT, "No such file or directory")
+
+        names = self.dir_cache.get(curr_inode.direct[0])
+        self._store_dir(curr_inode, raw_data, names, touched_data_blocks)
+        if names is not None:
+            names.pop(child_name, None)
+
+    def _replace_dir_entry(self, curr_inode: Inode, child_name: str, child_ino: int, new_name: str, touched_data_blocks: List[int]):
+        """
+        Turn the entry called child_name into (child_ino, new_name), keeping its place in the directory.
+        """
+        raw_data = DictEnDecoder.replace_entry(self._dir_raw(curr_inode), child_name, child_ino, new_name)
+        if raw_data is None:
+            raise OSError(errno.ENOENT, "No such file or directory")
+
+        names = self.dir_cache.get(curr_inode.direct[0])
+        if names is not None and new_name != child_name:
+            # a new key has to take the old one's place in the order, so this map is rebuilt
+            names = {(new_name if name == child_name else name): (child_ino if name == child_name else ino)
+                     for name, ino in names.items()}
+        self._store_dir(curr_inode, raw_data, names, touched_data_blocks)
+        if names is not None:
+            names[new_name] = child_ino
+
+    def _dir_raw(self, curr_inode: Inode) -> memoryview:
+        # the directory's bytes, viewed in its cached page
+        return self.page_cache.load(curr_inode.direct[0]).data[:curr_inode.size]
+
+    def _store_dir(self, curr_inode: Inode, raw_data: bytes, names: Optional[Dict[str, int]], touched_data_blocks: List[int]):
+        """
+        names: decoded form of raw_data for the dir cache, or None to leave the block to be decoded on demand
+        """
+        if len(raw_data) > self._bs:
             raise OSError(errno.ENOSPC, "dir too large (limit: 1 block)")
         blk_offset = curr_inode.direct[0]
         if blk_offset == ROOT_INO:
             return
-        self._write_block_cached(blk_offset, raw_data.ljust(self.sb.block_size, b"\x00"))
+        # the block was last written as the curr_inode.size bytes of the old entries, zero-padded
+        self._write_block_cached(blk_offset, raw_data, curr_inode.size)
+        if names is not None:
+            self.dir_cache.put(blk_offset, names)
         touched_data_blocks.append(blk_offset)
         curr_inode.size = len(raw_data)
 
     def _alloc_inode(self):
         # loop from 1, not 0 due to inode 0 is root
-        ino = self.inode_bitmap.find_free_inode(1)
+        ino = self.inode_bitmap.alloc_inode(1)
         if ino < 0:
             raise OSError(errno.ENOSPC, "No free inode") 
-        self.inode_bitmap.set_used(ino)
         return ino
         
     def _free_inode(self, ino: int):
         self.inode_bitmap.clear_used(ino)
+        self.inode_cache.remove(ino)
         return
     
     def _alloc_block(self):
-        blk_idx = self.block_bitmap.find_free_block(self.sb.data_start)
+        if self._reserved:
+            return self._reserved.pop()
+        blk_idx = self.block_bitmap.alloc_block(self._data_start)
         if blk_idx < 0:
             raise OSError(errno.ENOSPC, "No free block") 
-        self.block_bitmap.set_used(blk_idx)
         return blk_idx
     
+    def _reserve_blocks(self, count: int):
+        # claim count contiguous blocks up front so a large write lands in one run even on a
+        # fragmented bitmap; without such a run allocation falls back to block-by-block first fit
+        start = self.block_bitmap.alloc_run(self._data_start, count)
+        if start >= 0:
+            self._reserved = list(range(start + count - 1, start - 1, -1))
+
+    def _release_reserved(self):
+        # whatever the write left over is one tail of the run: a single range clear
+        self.block_bitmap.clear_many(self._reserved)
+        self._reserved = []
+
     def _free_block(self, blk_idx: int):
         self.block_bitmap.clear_used(blk_idx)
         return
@@ -88,154 +252,183 @@ class WayneFS(LoggingMixIn, Operations):
     def _lookup(self, path: str): 
         if path == "/" or path == "":
             return ROOT_INO
-        
-        cached_ino = self.dentry_cache.get(path)
-        if cached_ino is not None:
-            return cached_ino
-            
-        all_path_stack = [seg for seg in path.split("/") if seg][::-1]
+
+        # segments are walked in place with a cursor, no reversed copy; empty ones come from
+        # "//" and the leading "/"
+        parts = path.split("/")
+        pos, n_parts = 0, len(parts)
         curr_ino = ROOT_INO
-        while all_path_stack:
-            name = all_path_stack.pop()
-            if name == ".":
+        # hot fields of curr_ino, read only when a segment misses the dentry cache; one read
+        # serves both the directory check and the lookup of the next name
+        curr_inode = None
+        # bound once: a walk that hits the dentry cache does little else per segment
+        dentry_get = self.dentry_cache.get
+        while pos < n_parts:
+            name = parts[pos]
+            pos += 1
+            if not name or name == ".":
                 continue
-            elif name == "..":
-                curr_inode = self._iget(curr_ino)
-                if (curr_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
-                    raise OSError(errno.ENOENT, "[A] No such file or directory") 
-                parent_ino = None
-                for child_ino, child_name in self._read_dir_entries(curr_inode):
-                    if child_name == name:
-                        parent_ino = child_ino
-                        break
-                # not found
-                if parent_ino is None:
-                    parent_ino = ROOT_INO
-                curr_ino = parent_ino
-            else:
-                curr_inode = self._iget(curr_ino)
-                if (curr_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
-                    raise OSError(errno.ENOENT, "[B] No such file or directory") 
-                next_ino = None
-                for child_ino, child_name in self._read_dir_entries(curr_inode):
-                    if child_name == name:
-                        next_ino = child_ino
-                        break
-                # not found
-                if next_ino is None:
-                    raise OSError(errno.ENOENT, "[C] No such file or directory") 
-                
-                curr_ino = next_ino
-                curr_inode = self._iget(curr_ino)
-                if (curr_inode.mode & InodeMode.S_IFMT) == InodeMode.S_IFLNK and all_path_stack:
-                    target_len = curr_inode.size
-                    target = bytearray()
-
-                    if target_len <= 48:
-                        target = struct.pack("<12I", *curr_inode.direct)
-                    else:
-                        start_block_idx = 0
-                        end_block_idx = (target_len - 1) // self.sb.block_size
-                        for curr_block_idx in range(start_block_idx, end_block_idx+1):
-                            addr = self._get_data_block_addr(curr_inode, curr_block_idx)
-                            target += self._read_block_cached(addr)
-                    
-                    symlink_name = target[:target_len].decode("utf-8")
-                    if symlink_name.startswith('/'):
-                        curr_ino = ROOT_INO
-                        target_path = [seg for seg in symlink_name.split("/") if seg][::-1]
-                    else:
-                        all_path_stack.append(name)
-                        target_path = [seg for seg in symlink_name.split("/") if seg][::-1]
-
-                    all_path_stack.extend(target_path)
+
+            # a cached (dir, name) pair was found in a directory and never names a symlink,
+            # so a hit needs neither inode; ".." is never cached, a rename can move it
+            if name != "..":
+                next_ino = dentry_get(curr_ino, name)
+                if next_ino is not None:
+                    curr_ino, curr_inode = next_ino, None
                     continue
 
-        self.dentry_cache.put(path, curr_ino)
+            if curr_inode is None:
+                # a directory searched on a miss is usually wanted again (as the parent of a
+                # create, or for readdir), so it is decoded whole and kept
+                curr_inode = self._iget(curr_ino)
+            if (curr_inode.mode & S_IFMT) != S_IFDIR:
+                raise OSError(errno.ENOENT, "[B] No such file or directory") 
+            next_ino = self._find_dir_entry(curr_inode, name)
+            if name == "..":
+                # never a symlink, and the root is its own parent
+                curr_ino, curr_inode = ROOT_INO if next_ino is None else next_ino, None
+                continue
+            # not found
+            if next_ino is None:
+                raise OSError(errno.ENOENT, "[C] No such file or directory") 
+            
+            dir_ino, dir_inode = curr_ino, curr_inode
+            curr_ino = next_ino
+            curr_inode = self._iget_hot(curr_ino)
+            if (curr_inode.mode & S_IFMT) != S_IFLNK:
+                self.dentry_cache.put(dir_ino, name, curr_ino)
+            elif pos < n_parts:
+                symlink_name = self._read_link_target(curr_ino, curr_inode)
+                # the target's segments take the link's place ahead of the rest of the path
+                parts = symlink_name.split("/") + parts[pos:]
+                pos, n_parts = 0, len(parts)
+                if symlink_name.startswith('/'):
+                    curr_ino, curr_inode = ROOT_INO, None
+                else:
+                    # a relative target starts from the directory holding the link
+                    curr_ino, curr_inode = dir_ino, dir_inode
+
         return curr_ino
     
     def _split(self, path: str) -> Tuple[str, str]:
         if path == "/" or path == "":
             return path, None
         
-        all_path = [seg for seg in path.split("/") if seg]
+        # FUSE paths are absolute and carry no trailing "/"
+        parent, _, name = path.rpartition("/")
+        return parent or "/", name
 
-        return "/".join(all_path[:-1]),all_path[-1]
+    def _lookup_parent(self, path: str) -> Tuple[int, Inode, str, Optional[int]]:
+        """
+        Walk to the parent directory of path once and look the last segment up in it.
+        return: (parent_ino, parent_inode, name, ino of name or None)
+        """
+        parent_path, name = self._split(path)
+        parent_ino = self._lookup(parent_path)
+        parent_inode = self._iget(parent_ino)
+        if (parent_inode.mode & S_IFMT) != S_IFDIR:
+            raise OSError(errno.ENOENT, "No such directory") 
+        return parent_ino, parent_inode, name, self._find_dir_entry(parent_inode, name)
     
-    def _get_data_block_addr(self, inode: Inode, logical_block_idx: int) -> int:
-        ADDRS_PER_BLOCK = self.sb.block_size // 4     # 1024
+    def _read_ptr(self, block_addr: int, index: int) -> int:
+        # one block pointer, read in place from the cached pointer block
+        return PTR_STRUCT.unpack_from(self.page_cache.load(block_addr).data, index * 4)[0]
+
+    def _write_ptr(self, block_addr: int, index: int, addr: int):
+        self._patch_block_cached(block_addr, index * 4, PTR_STRUCT.pack(addr))
+
+    def _read_link_target(self, ino: int, inode) -> str:
+        """
+        inode: Inode or InodeHot of the symlink ino
+        return: its target path
+        """
+        target_len = inode.size
+        if target_len <= 48:
+            # fast symlink: the target bytes sit in place of the block pointers; slice them
+            # out of the inode table page instead of re-packing the decoded pointers
+            target = self.inode_table.read_inline(ino, target_len)
+        else:
+            bs = self._bs
+            addrs = self._get_data_block_addrs(inode, 0, ceil_div(target_len, bs))
+            if len(addrs) == 1:
+                # the whole target sits in one page: decode it in place
+                return str(self.page_cache.load(addrs[0]).data[:target_len], "utf-8")
+            # each page is copied straight into its place in the target, nothing past target_len
+            target = bytearray(target_len)
+            for i, addr in enumerate(addrs):
+                target[i * bs : (i + 1) * bs] = self.page_cache.load(addr).data[:target_len - i * bs]
+        # both forms hold exactly target_len bytes
+        return str(target, "utf-8")
+
+    def _get_data_block_addrs(self, inode: Inode, start_block: int, end_block: int) -> List[int]:
+        """
+        Addresses of logical blocks [start_block, end_block), 0 for holes; each indirect block
+        touched is decoded with one unpack_from over the pointers in range, not one call per pointer.
+        """
+        ADDRS_PER_BLOCK = self._bs // 4     # 1024
         SINGLY_LIMIT = 10
         DOUBLY_LIMIT = SINGLY_LIMIT + ADDRS_PER_BLOCK # 10 + 1024 = 1034
 
         # direct[0] ~ direct[9]
-        if logical_block_idx < SINGLY_LIMIT:
-            return inode.direct[logical_block_idx]
+        addrs = inode.direct[start_block:min(end_block, SINGLY_LIMIT)]
 
         # direct[10]
-        elif logical_block_idx < DOUBLY_LIMIT:
-            l1_block_content = self._read_block_cached(inode.direct[10])
-            
-            l1_index = logical_block_idx - SINGLY_LIMIT
-            ptr_offset = l1_index * 4
-            
-            addr_bytes = l1_block_content[ptr_offset : ptr_offset + 4]
-            return struct.unpack("<I", addr_bytes)[0]
+        lo, hi = max(start_block, SINGLY_LIMIT), min(end_block, DOUBLY_LIMIT)
+        if lo < hi:
+            addrs += self._read_ptrs(inode.direct[10], lo - SINGLY_LIMIT, hi - SINGLY_LIMIT)
 
         # direct[11]
-        else:
-            l1_block_content = self._read_block_cached(inode.direct[11])
-            
-            l1_index = (logical_block_idx - DOUBLY_LIMIT) // ADDRS_PER_BLOCK
-            ptr_offset_l1 = l1_index * 4
-
-            l2_addr_bytes = l1_block_content[ptr_offset_l1 : ptr_offset_l1 + 4]
-            l2_addr = struct.unpack("<I", l2_addr_bytes)[0]
-
-            l2_block_content = self._read_block_cached(l2_addr)
-            
-            l2_index = (logical_block_idx - DOUBLY_LIMIT) % ADDRS_PER_BLOCK
-            ptr_offset_l2 = l2_index * 4
-            
-            addr_bytes = l2_block_content[ptr_offset_l2 : ptr_offset_l2 + 4]
-            return struct.unpack("<I", addr_bytes)[0]
-        
-    def _get_or_alloc_data_block_addr(self, inode: Inode, logical_block_idx: int, touched_data_blocks: List[int]) -> int:
-        ADDRS_PER_BLOCK = self.sb.block_size // 4     # 1024
+        lo = max(start_block, DOUBLY_LIMIT)
+        while lo < end_block:
+            l1_index, l2_lo = divmod(lo - DOUBLY_LIMIT, ADDRS_PER_BLOCK)
+            hi = min(end_block, lo + ADDRS_PER_BLOCK - l2_lo)
+            l2_addr = self._read_ptr(inode.direct[11], l1_index) if inode.direct[11] else 0
+            addrs += self._read_ptrs(l2_addr, l2_lo, l2_lo + hi - lo)
+            lo = hi
+        return addrs
+
+    def _read_ptrs(self, block_addr: int, lo: int, hi: int) -> List[int]:
+        # pointers [lo, hi) of one indirect block; a missing block is a run of holes
+        if block_addr == 0:
+            return [0] * (hi - lo)
+        return list(ptrs_struct(hi - lo).unpack_from(self.page_cache.load(block_addr).data, lo * 4))
+
+    def _alloc_zeroed_block(self, touched_data_blocks: List[int]) -> int:
+        addr = self._alloc_block()
+        self._write_block_cached(addr, self._zero_block)
+        touched_data_blocks.append(addr)
+        return addr
+
+    def _alloc_data_block(self, touched_data_blocks: List[int], zero_fill: bool) -> int:
+        return self._alloc_zeroed_block(touched_data_blocks) if zero_fill else self._alloc_block()
+
+    def _get_or_alloc_data_block_addr(self, inode: Inode, logical_block_idx: int, touched_data_blocks: List[int], zero_fill: bool = True) -> int:
+        """
+        zero_fill: zero a newly allocated data block; the caller may skip it when it overwrites the
+        whole block anyway. New pointer blocks are always zeroed
+        """
+        ADDRS_PER_BLOCK = self._bs // 4     # 1024
         SINGLY_LIMIT = 10
         DOUBLY_LIMIT = SINGLY_LIMIT + ADDRS_PER_BLOCK # 10 + 1024 = 1034
 
         # direct[0] ~ direct[9]
         if logical_block_idx < SINGLY_LIMIT:
             if inode.direct[logical_block_idx] == 0:
-                proc_block_addr = self._alloc_block()
-                self._write_block_cached(proc_block_addr, b'\x00' * self.sb.block_size)
-                touched_data_blocks.append(proc_block_addr)
-                
-                inode.direct[logical_block_idx] = proc_block_addr
+                inode.direct[logical_block_idx] = self._alloc_data_block(touched_data_blocks, zero_fill)
             return inode.direct[logical_block_idx]
         
         # direct[10]
         elif logical_block_idx < DOUBLY_LIMIT:
             if inode.direct[10] == 0:
-                inode.direct[10] = self._alloc_block()
-                self._write_block_cached(inode.direct[10], b'\x00' * self.sb.block_size)
-                touched_data_blocks.append(inode.direct[10])
+                inode.direct[10] = self._alloc_zeroed_block(touched_data_blocks)
 
-            l1_block_content = bytearray(self._read_block_cached(inode.direct[10]))
-            
             l1_index = logical_block_idx - SINGLY_LIMIT
-            ptr_offset = l1_index * 4
-            
-            addr = struct.unpack("<I", l1_block_content[ptr_offset : ptr_offset + 4])[0]
+            addr = self._read_ptr(inode.direct[10], l1_index)
 
             # allocate
             if addr == 0:
-                addr = self._alloc_block()
-                self._write_block_cached(addr, b'\x00' * self.sb.block_size)
-                touched_data_blocks.append(addr)
-
-                l1_block_content[ptr_offset : ptr_offset + 4] = struct.pack("<I", addr)
-                self._write_block_cached(inode.direct[10], bytes(l1_block_content).ljust(self.sb.block_size, b"\x00"))
+                addr = self._alloc_data_block(touched_data_blocks, zero_fill)
+                self._write_ptr(inode.direct[10], l1_index, addr)
                 touched_data_blocks.append(inode.direct[10])
 
             return addr
@@ -243,138 +436,156 @@ class WayneFS(LoggingMixIn, Operations):
         # direct[11]
         else:
             if inode.direct[11] == 0:
-                inode.direct[11] = self._alloc_block()
-                self._write_block_cached(inode.direct[11], b'\x00' * self.sb.block_size)
-                touched_data_blocks.append(inode.direct[11])
-
-            l1_block_content = bytearray(self._read_block_cached(inode.direct[11]))
-            
-            l1_index = (logical_block_idx - DOUBLY_LIMIT) // ADDRS_PER_BLOCK
-            ptr_offset_l1 = l1_index * 4
+                inode.direct[11] = self._alloc_zeroed_block(touched_data_blocks)
 
-            l2_addr_bytes = l1_block_content[ptr_offset_l1 : ptr_offset_l1 + 4]
-            l2_addr = struct.unpack("<I", l2_addr_bytes)[0]
+            l1_index, l2_index = divmod(logical_block_idx - DOUBLY_LIMIT, ADDRS_PER_BLOCK)
+            l2_addr = self._read_ptr(inode.direct[11], l1_index)
 
             if l2_addr == 0:
-                l2_addr = self._alloc_block()
-                self._write_block_cached(l2_addr, b'\x00' * self.sb.block_size)
-                touched_data_blocks.append(l2_addr)
-
-                l1_block_content[ptr_offset_l1 : ptr_offset_l1 + 4] = struct.pack("<I", l2_addr)
-                self._write_block_cached(inode.direct[11], bytes(l1_block_content).ljust(self.sb.block_size, b"\x00"))
+                l2_addr = self._alloc_zeroed_block(touched_data_blocks)
+                self._write_ptr(inode.direct[11], l1_index, l2_addr)
                 touched_data_blocks.append(inode.direct[11])
 
-            l2_block_content = bytearray(self._read_block_cached(l2_addr))
-            
-            l2_index = (logical_block_idx - DOUBLY_LIMIT) % ADDRS_PER_BLOCK
-            ptr_offset_l2 = l2_index * 4
-            
-            addr = struct.unpack("<I", l2_block_content[ptr_offset_l2 : ptr_offset_l2 + 4])[0]
+            addr = self._read_ptr(l2_addr, l2_index)
 
             # allocate
             if addr == 0:
-                addr = self._alloc_block()
-                self._write_block_cached(addr, b'\x00' * self.sb.block_size)
-                touched_data_blocks.append(addr)
-
-                l2_block_content[ptr_offset_l2 : ptr_offset_l2 + 4] = struct.pack("<I", addr)
-                self._write_block_cached(l2_addr, bytes(l2_block_content).ljust(self.sb.block_size, b"\x00"))
+                addr = self._alloc_data_block(touched_data_blocks, zero_fill)
+                self._write_ptr(l2_addr, l2_index, addr)
                 touched_data_blocks.append(l2_addr)
 
             return addr
         
-    def _free_data_blocks(self, inode: Inode, start_block: int, end_block: int, touched_data_blocks: List[int]):
-        ADDRS_PER_BLOCK = self.sb.block_size // 4     # 1024
+    def _free_data_blocks(self, inode: Inode, start_block: int, end_block: int, touched_data_blocks: List[int], zero_ptrs: bool = True):
+        """
+        Free the data blocks behind logical blocks [start_block, end_block], all in one bitmap pass.
+        zero_ptrs: clear the freed pointers in the indirect blocks; not needed when the whole file goes
+        """
+        ADDRS_PER_BLOCK = self._bs // 4     # 1024
         SINGLY_LIMIT = 10
         DOUBLY_LIMIT = SINGLY_LIMIT + ADDRS_PER_BLOCK # 10 + 1024 = 1034
 
-        # get addr => free block (addr) => set value 0
-        for logical_block_idx in range(start_block, end_block+1):
-            
-            if logical_block_idx < SINGLY_LIMIT:
-                if inode.direct[logical_block_idx] != 0:
-                    self._free_block(inode.direct[logical_block_idx])
-                    inode.direct[logical_block_idx] = 0
-
-            elif logical_block_idx < DOUBLY_LIMIT:
-                if inode.direct[10] == 0:
-                    continue
-
-                l1_block_content = bytearray(self._read_block_cached(inode.direct[10]))
-                l1_index = logical_block_idx - SINGLY_LIMIT
-                ptr_offset = l1_index * 4
-
-                addr = struct.unpack("<I", l1_block_content[ptr_offset:ptr_offset+4])[0]
-
-                if addr != 0:
-                    self._free_block(addr)
-                    l1_block_content[ptr_offset:ptr_offset+4] = struct.pack("<I", 0)
-                    self._write_block_cached(inode.direct[10], bytes(l1_block_content).ljust(self.sb.block_size, b"\x00"))
-                    touched_data_blocks.append(inode.direct[10])
-
-            else:
-                if inode.direct[11] == 0:
-                    break
+        end = min(end_block + 1, self.MAX_BLOCKS)
+        freed = []
 
-                l1_block_content = bytearray(self._read_block_cached(inode.direct[11]))
-                l1_index = (logical_block_idx - DOUBLY_LIMIT) // ADDRS_PER_BLOCK
-                ptr_offset_l1 = l1_index * 4
+        # direct[0] ~ direct[9]
+        for logical_block_idx in range(start_block, min(end, SINGLY_LIMIT)):
+            if inode.direct[logical_block_idx] != 0:
+                freed.append(inode.direct[logical_block_idx])
+                inode.direct[logical_block_idx] = 0
 
-                l2_addr_bytes = l1_block_content[ptr_offset_l1 : ptr_offset_l1 + 4]
-                l2_addr = struct.unpack("<I", l2_addr_bytes)[0]
+        # direct[10]
+        lo, hi = max(start_block, SINGLY_LIMIT), min(end, DOUBLY_LIMIT)
+        if lo < hi and inode.direct[10] != 0:
+            self._free_ptr_range(inode.direct[10], lo - SINGLY_LIMIT, hi - SINGLY_LIMIT, freed, touched_data_blocks, zero_ptrs)
 
+        # direct[11]
+        lo = max(start_block, DOUBLY_LIMIT)
+        if lo < end and inode.direct[11] != 0:
+            for l1_index in range((lo - DOUBLY_LIMIT) // ADDRS_PER_BLOCK, (end - 1 - DOUBLY_LIMIT) // ADDRS_PER_BLOCK + 1):
+                l2_addr = self._read_ptr(inode.direct[11], l1_index)
                 if l2_addr == 0:
                     continue
+                base = DOUBLY_LIMIT + l1_index * ADDRS_PER_BLOCK
+                self._free_ptr_range(l2_addr, max(lo, base) - base, min(end, base + ADDRS_PER_BLOCK) - base,
+                                     freed, touched_data_blocks, zero_ptrs)
+
+        self.block_bitmap.clear_many(freed)
+
+    def _free_ptr_range(self, block_addr: int, lo: int, hi: int, freed: List[int], touched_data_blocks: List[int], zero_ptrs: bool):
+        # pointers [lo, hi) of one indirect block, unpacked in one go from its cached page
+        count = hi - lo
+        # filter(None, ...) drops the holes in C, no per-pointer bytecode
+        live = list(filter(None, self._read_ptrs(block_addr, lo, hi)))
+        if not live:
+            return
+        freed.extend(live)
+        if zero_ptrs:
+            self._patch_block_cached(block_addr, lo * 4, self._zero_view[:count * 4])
+            touched_data_blocks.append(block_addr)
 
-                l2_block_content = bytearray(self._read_block_cached(l2_addr))
-                
-                l2_index = (logical_block_idx - DOUBLY_LIMIT) % ADDRS_PER_BLOCK
-                ptr_offset_l2 = l2_index * 4
-
-                addr = struct.unpack("<I", l2_block_content[ptr_offset_l2 : ptr_offset_l2 + 4])[0]
+    def _free_indirect_blocks(self, inode: Inode, keep_blks: int):
+        """
+        Free the pointer blocks a file of keep_blks blocks no longer needs.
+        """
+        ADDRS_PER_BLOCK = self._bs // 4
+        SINGLY_LIMIT = 10
+        DOUBLY_LIMIT = SINGLY_LIMIT + ADDRS_PER_BLOCK
 
-                if addr != 0:
-                    self._free_block(addr)
-                    l2_block_content[ptr_offset_l2 : ptr_offset_l2 + 4] = struct.pack("<I", 0)
-                    self._write_block_cached(l2_addr, bytes(l2_block_content).ljust(self.sb.block_size, b"\x00"))
-                    touched_data_blocks.append(l2_addr)
+        freed = []
+        if keep_blks <= DOUBLY_LIMIT and inode.direct[11] != 0:
+            l1_data = self.page_cache.load(inode.direct[11]).data
+            freed.extend(filter(None, ptrs_struct(ADDRS_PER_BLOCK).unpack_from(l1_data)))
+            freed.append(inode.direct[11])
+            inode.direct[11] = 0
+        if keep_blks <= SINGLY_LIMIT and inode.direct[10] != 0:
+            freed.append(inode.direct[10])
+            inode.direct[10] = 0
+        self.block_bitmap.clear_many(freed)
 
     # --- cache helper ---
-    def _read_block_cached(self, block_addr: int) -> bytes:
-        if self.page_cache.is_cached(block_addr):
-            return bytes(self.page_cache.get(block_addr).data)
-            
-        data = self.disk.read_block(block_addr)
-        self.page_cache.put(block_addr, data)
-        return data
-    
-    def _write_block_cached(self, block_addr: int, data: bytes):
-        if not self.page_cache.is_cached(block_addr):
-            self.page_cache.put(block_addr, data)
-        
+    def _write_block_cached(self, block_addr: int, data: bytes, old_len: Optional[int] = None):
+        """
+        data: at most one block; a shorter buffer is zero-padded in the page, not copied first
+        old_len: the cached page is known to be zero past old_len, so only [len(data), old_len) is cleared
+        """
+        # any rewrite of a block drops its decoded directory, whatever the block is used for now
+        self.dir_cache.remove(block_addr)
+        n = len(data)
         page = self.page_cache.get(block_addr)
-        page.data[:] = data
-        page.dirty = True
+        if page is None and n == self._bs:
+            page = self.page_cache.put(block_addr, data)
+        else:
+            if page is None:
+                page = self.page_cache.put(block_addr, self._zero_block)
+            elif n < self._bs:
+                end = self._bs if old_len is None else min(old_len, self._bs)
+                if end > n:
+                    page.data[n:end] = self._zero_view[n:end]
+            page.data[:n] = data
+        self.page_cache.mark_dirty(block_addr)
     
+    def _patch_block_cached(self, block_addr: int, offset: int, data):
+        """
+        Overwrite data at offset inside one block, in its cached page.
+        """
+        self.dir_cache.remove(block_addr)
+        page = self.page_cache.load(block_addr)
+        page.data[offset:offset + len(data)] = data
+        self.page_cache.mark_dirty(block_addr)
+
     def sync_data_cache(self):
         dirty_pages = self.page_cache.get_dirty_pages()
 
         dirty_pages.sort(key=lambda x: x[0])
-        for block_addr, page in dirty_pages:
-            self.disk.write_block(block_addr, bytes(page.data))
-            page.dirty = False
+        self.disk.write_scattered([(block_addr, page.data) for block_addr, page in dirty_pages])
+        for block_addr, _ in dirty_pages:
+            self.page_cache.mark_clean(block_addr)
         
         if dirty_pages:
             self.disk.fsync()
-            print(f"[Debug] Synced {len(dirty_pages)} pages to disk.")
+            log.debug("Synced %d pages to disk.", len(dirty_pages))
             
 
     # --- FUSE ops ---    
+    def __call__(self, op, *args):
+        # every operation sees the filesystem state as of its start; results are materialised
+        # under the lock (see readdir), so nothing is computed after it is released
+        with self._op_lock:
+            if self.log.isEnabledFor(logging.DEBUG):
+                return super().__call__(op, *args)
+            # LoggingMixIn repr()s every argument and result, read and write buffers included,
+            # before the logger gets to drop the record; skip it unless the trace is wanted
+            return Operations.__call__(self, op, *args)
+
     def getattr(self, path, fh=None):
         curr_ino = self._lookup(path)
+        attrs = self.attr_cache.get(curr_ino)
+        if attrs is not None:
+            return dict(attrs)
         curr_inode = self._iget(curr_ino)
-        print("getattr", path, "->", curr_ino, curr_inode.mode, curr_inode.nlink, curr_inode.size)
-        return {
+        log.debug("getattr %s -> %d %o %d %d", path, curr_ino, curr_inode.mode, curr_inode.nlink, curr_inode.size)
+        attrs = {
                 "st_mode" : curr_inode.mode,
                 "st_nlink": curr_inode.nlink,
                 "st_size" : curr_inode.size,
@@ -383,30 +594,24 @@ class WayneFS(LoggingMixIn, Operations):
                 "st_atime": curr_inode.atime,
                 "st_ino": curr_ino,
             }
+        self.attr_cache.put(curr_ino, attrs)
+        return dict(attrs)
 
     def readdir(self, path, fh):
         ino = self._lookup(path)  # validate path exists (root only)
         curr_inode = self._iget(ino)
-        print("readdir", path, "entries:", [nm for _,nm in self._read_dir_entries(curr_inode)])
-        yield "."
-        yield ".."
-        for _, name in self._read_dir_entries(curr_inode):
-            if not name or name in [".", ".."]:
-                continue
-            yield name
+        # the cached name map already is the listing; no (ino, name) tuples to build and unpack
+        names = [name for name in self._dir_names(curr_inode) if name and name not in (".", "..")]
+        log.debug("readdir %s entries: %s", path, names)
+        # a list rather than a generator: fusepy iterates the result after __call__ returns
+        return [".", "..", *names]
     
     def mkdir(self, path, mode: int):
-        parent_path, curr_dir_name = self._split(path)
-        parent_ino = self._lookup(parent_path)
-        parent_inode = self._iget(parent_ino)
-        if (parent_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
-            raise OSError(errno.ENOENT, "No such directory") 
+        parent_ino, parent_inode, curr_dir_name, existing_ino = self._lookup_parent(path)
         
         # check the curr_dir_name not in parent_inode entries
-        parent_entries = self._read_dir_entries(parent_inode)
-        for _, child_name in parent_entries:
-            if child_name == curr_dir_name:
-                raise OSError(errno.EEXIST, "Directory is existed") 
+        if existing_ino is not None:
+            raise OSError(errno.EEXIST, "Directory is existed") 
         
         child_ino = self._alloc_inode()
         child_blk = self._alloc_block()
@@ -415,11 +620,10 @@ class WayneFS(LoggingMixIn, Operations):
         touched_data_blocks = []
         child_entries = [(child_ino, "."), (parent_ino, "..")]
         raw_data = DictEnDecoder.pack_dir(child_entries)
-        self._write_block_cached(child_blk, raw_data + b"\x00" * (self.sb.block_size - len(raw_data)))
+        self._write_block_cached(child_blk, raw_data)
         touched_data_blocks.append(child_blk)
         
-        parent_entries.append((child_ino, curr_dir_name))
-        self._write_dir_entries(parent_inode, parent_entries, touched_data_blocks)
+        self._add_dir_entry(parent_inode, child_ino, curr_dir_name, touched_data_blocks)
 
         with self.journal.begin() as tx:
 
@@ -427,56 +631,49 @@ class WayneFS(LoggingMixIn, Operations):
                 tx.add_data_dependency(block_addr)
 
             # Child Inode
-            child_inode = Inode.empty(mode=(InodeMode.S_IFDIR | mode))
+            child_inode = Inode.empty(mode=(S_IFDIR | mode))
             child_inode.nlink = 2
             child_inode.size  = len(raw_data)
             child_inode.direct[0] = child_blk
-            self.inode_table.write(child_ino, child_inode, tx)
+            self._iput(child_ino, child_inode, tx)
 
             # Parent Inode
             parent_inode.nlink += 1
             parent_inode.ctime = parent_inode.mtime = child_inode.ctime
-            self.inode_table.write(parent_ino, parent_inode, tx)
+            self._iput(parent_ino, parent_inode, tx)
 
             self.inode_bitmap.flush(tx)
             self.block_bitmap.flush(tx)
 
 
     def rmdir(self, path):
-        parent_path, _ = self._split(path)
-        parent_ino = self._lookup(parent_path)
-        parent_inode = self._iget(parent_ino)
-
-        curr_ino = self._lookup(path)
+        if path == "/" or path == "":
+            raise OSError(errno.EPERM, "Root directory can not be removed")
+        parent_ino, parent_inode, curr_name, curr_ino = self._lookup_parent(path)
+        if curr_ino is None:
+            raise OSError(errno.ENOENT, "No such file or directory")
         if curr_ino == ROOT_INO:
             raise OSError(errno.EPERM, "Root directory can not be removed")
          
         curr_inode = self._iget(curr_ino)
-        if (curr_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
+        if (curr_inode.mode & S_IFMT) != S_IFDIR:
             raise OSError(errno.ENOENT, "No such directory") 
         
-        curr_entries = self._read_dir_entries(curr_inode)
-        if len(curr_entries) > 2:
+        # only "." and ".." left
+        if len(self._dir_names(curr_inode)) > 2:
             raise OSError(errno.ENOTEMPTY, "Directory is not empty") 
         
+        touched_data_blocks = []
+        # write back entries of parent; first, since it can fail and the parent is the cached
+        # object: nothing may be changed before it
+        self._remove_dir_entry(parent_inode, curr_name, touched_data_blocks)
+        self.dentry_cache.remove(parent_ino, curr_name)
+
         self._free_block(curr_inode.direct[0])
         self._free_inode(curr_ino)
 
-        old_parent_entries = self._read_dir_entries(parent_inode)
-        new_parent_entries = []
-        for child_ino, child_name in old_parent_entries:
-            if child_ino == curr_ino:
-                continue
-            new_parent_entries.append((child_ino, child_name))
-
-        assert len(old_parent_entries) == len(new_parent_entries) + 1
-        
         parent_inode.nlink -= 1
         assert parent_inode.nlink >= 2
-
-        touched_data_blocks = []
-        # write back entries of parent
-        self._write_dir_entries(parent_inode, new_parent_entries, touched_data_blocks)
         
         # write back of parent inode to inode table
         with self.journal.begin() as tx:
@@ -484,11 +681,9 @@ class WayneFS(LoggingMixIn, Operations):
             for block_addr in touched_data_blocks:
                 tx.add_data_dependency(block_addr)
 
-            self.inode_table.write(parent_ino, parent_inode, tx)
+            self._iput(parent_ino, parent_inode, tx)
             self.block_bitmap.flush(tx)
             self.inode_bitmap.flush(tx)
-        
-        self.dentry_cache.remove(path)
 
     def open(self, path, flags):
         # Check file existed and get file ino
@@ -499,35 +694,27 @@ class WayneFS(LoggingMixIn, Operations):
         return curr_fh
     
     def create(self, path, mode):
-        parent_path, curr_file_name = self._split(path)
-
-        parent_ino = self._lookup(parent_path)
-        parent_inode = self._iget(parent_ino)
-        if (parent_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
-            raise OSError(errno.ENOENT, "No such directory") 
+        parent_ino, parent_inode, curr_file_name, existing_ino = self._lookup_parent(path)
         
         # check the curr_dir_name not in parent_inode entries
-        parent_entries = self._read_dir_entries(parent_inode)
-        for _, child_name in parent_entries:
-            if child_name == curr_file_name:
-                raise OSError(errno.EEXIST, "File is existed") 
+        if existing_ino is not None:
+            raise OSError(errno.EEXIST, "File is existed") 
         
         child_ino = self._alloc_inode()
-        parent_entries.append((child_ino, curr_file_name))
         touched_data_blocks = []
-        self._write_dir_entries(parent_inode, parent_entries, touched_data_blocks)
+        self._add_dir_entry(parent_inode, child_ino, curr_file_name, touched_data_blocks)
 
         with self.journal.begin() as tx:
 
             for block_addr in touched_data_blocks:
                 tx.add_data_dependency(block_addr)
 
-            child_inode = Inode.empty(mode=(InodeMode.S_IFREG | mode))
+            child_inode = Inode.empty(mode=(S_IFREG | mode))
             child_inode.nlink = 1
             child_inode.size = 0
-            self.inode_table.write(child_ino, child_inode, tx)
+            self._iput(child_ino, child_inode, tx)
             parent_inode.ctime = parent_inode.mtime = child_inode.ctime
-            self.inode_table.write(parent_ino, parent_inode, tx)
+            self._iput(parent_ino, parent_inode, tx)
             self.inode_bitmap.flush(tx)
 
         curr_fh = self.next_fh
@@ -536,69 +723,90 @@ class WayneFS(LoggingMixIn, Operations):
         return curr_fh
     
     def write(self, path, data, offset, fh):
-        if fh not in self.open_file_table:
+        # one probe both validates fh and fetches its state
+        curr_file_state = self.open_file_table.get(fh)
+        if curr_file_state is None:
             raise OSError(errno.EBADF, "Bad file descriptor")
-    
-        curr_file_state = self.open_file_table[fh]
         curr_inode = self._iget(curr_file_state.ino)
 
         length = len(data)
         if length == 0:
             return 0
         
-        start_block_idx = offset // self.sb.block_size
-        end_block_idx = (offset + length - 1) // self.sb.block_size
+        start_block_idx = offset // self._bs
+        end_block_idx = (offset + length - 1) // self._bs
 
         # Check file size constrain (12 direct link)
         if end_block_idx >= self.MAX_BLOCKS:
             raise OSError(errno.EFBIG, "File too large")
         
+        bs = self._bs
         touched_data_blocks = []
 
-        # Generate the link from inode direct to disk offset 
-        for curr_block_idx in range(start_block_idx, end_block_idx+1):
-            self._get_or_alloc_data_block_addr(curr_inode, curr_block_idx, touched_data_blocks)
-
+        # Generate the link from inode direct to disk offset; keep the addresses for the copy below.
+        # Mapped blocks come from one decode per indirect block, only holes take the allocating walk
+        addrs = self._get_data_block_addrs(curr_inode, start_block_idx, end_block_idx + 1)
+        # every hole in the range gets a new block, past EOF or not; claim them as one run
+        holes = addrs.count(0)
+        if holes > 1:
+            self._reserve_blocks(holes)
+        try:
+            # only the first and last block can be partly written; a new block that the
+            # write covers whole needs no zeros first
+            first_whole = offset % bs == 0
+            last_whole = (offset + length) % bs == 0
+            for i, addr in enumerate(addrs):
+                if addr == 0:
+                    whole = (i > 0 or first_whole) and (i < len(addrs) - 1 or last_whole)
+                    addrs[i] = self._get_or_alloc_data_block_addr(curr_inode, start_block_idx + i, touched_data_blocks,
+                                                                  zero_fill=not whole)
+        finally:
+            self._release_reserved()
+
+        view = memoryview(data)
+        # bytes of the first block that lie before offset
+        head = offset - start_block_idx * bs
         data_cursor = 0
         # Write buffer
-        for curr_block_idx in range(start_block_idx, end_block_idx+1):
-
-            curr_start_offset = offset % self.sb.block_size if curr_block_idx == start_block_idx else 0
-            curr_end_offset = (offset + length - 1) % self.sb.block_size + 1 if curr_block_idx == end_block_idx else self.sb.block_size
-
-            is_partial_write = curr_start_offset != 0 or curr_end_offset != self.sb.block_size
+        for i, addr in enumerate(addrs):
+            curr_start_offset = head if i == 0 else 0
+            curr_end_offset = min(bs, head + length - i * bs)
+            need_write_data_len = curr_end_offset - curr_start_offset
 
-            addr = self._get_data_block_addr(curr_inode, curr_block_idx)
-            if is_partial_write:
-                curr_block = bytearray(self._read_block_cached(addr))
+            if need_write_data_len == bs:
+                # whole block: the page takes its slice of data as is
+                self._write_block_cached(addr, view[data_cursor:data_cursor + bs])
             else:
-                curr_block = bytearray(self.sb.block_size)
-
-            need_write_data_len = curr_end_offset - curr_start_offset
-            curr_block[curr_start_offset: curr_end_offset] = data[data_cursor:data_cursor+need_write_data_len]
+                # partial block: patch the cached page in place, no block-sized copies
+                self._patch_block_cached(addr, curr_start_offset, view[data_cursor:data_cursor + need_write_data_len])
             data_cursor += need_write_data_len
-
-            self._write_block_cached(addr, bytes(curr_block))
             touched_data_blocks.append(addr)
 
+        # an overwrite inside the file, in the second of the last mtime update, changes no
+        # metadata: the data stays in the page cache until fsync or eviction, like any write-back
+        new_size = max(curr_inode.size, offset + length)
+        now = int(time.time())
+        if new_size == curr_inode.size and now == curr_inode.mtime and not self.block_bitmap.has_dirty():
+            return length
+
         # Add Journal record metadata
         with self.journal.begin() as tx:
 
             for block_addr in touched_data_blocks:
                 tx.add_data_dependency(block_addr)
 
-            curr_inode.size = max(curr_inode.size, offset+length)
-            curr_inode.mtime = int(time.time())
-            self.inode_table.write(curr_file_state.ino, curr_inode, tx)
+            curr_inode.size = new_size
+            curr_inode.mtime = now
+            self._iput(curr_file_state.ino, curr_inode, tx)
             self.block_bitmap.flush(tx)
 
         return length
     
     def read(self, path, size, offset, fh):
-        if fh not in self.open_file_table:
+        # one probe both validates fh and fetches its state
+        curr_file_state = self.open_file_table.get(fh)
+        if curr_file_state is None:
             raise OSError(errno.EBADF, "Bad file descriptor")
-    
-        curr_file_state = self.open_file_table[fh]
         curr_inode = self._iget(curr_file_state.ino)
 
         if offset >= curr_inode.size:
@@ -608,222 +816,208 @@ class WayneFS(LoggingMixIn, Operations):
         if size == 0:
             return b""
 
-        start_block_idx = offset // self.sb.block_size
-        end_block_idx = (offset + size - 1) // self.sb.block_size
-
-        data = bytearray(size)
-
-        data_cursor = 0
-
-        # Read buffer
-        for curr_block_idx in range(start_block_idx, end_block_idx+1):
-
-            curr_start_offset = offset % self.sb.block_size if curr_block_idx == start_block_idx else 0
-            curr_end_offset = (offset + size - 1) % self.sb.block_size + 1 if curr_block_idx == end_block_idx else self.sb.block_size
-
-            addr = self._get_data_block_addr(curr_inode, curr_block_idx)
-            curr_block = self._read_block_cached(addr)
-            need_read_data_len = curr_end_offset - curr_start_offset
-            data[data_cursor:data_cursor+need_read_data_len] = curr_block[curr_start_offset: curr_end_offset]
-            data_cursor += need_read_data_len
-
-        # Add Journal record metadata (access time)
-        with self.journal.begin() as tx:
-            curr_inode.atime = int(time.time())
-            self.inode_table.write(curr_file_state.ino, curr_inode, tx)
+        start_block_idx = offset // self._bs
+        end_block_idx = (offset + size - 1) // self._bs
+
+        bs = self._bs
+        # bytes of the first block that lie before offset
+        skip = offset - start_block_idx * bs
+        # one slice per block, joined into the result with a single copy at the end. Slices of
+        # cached pages are views; they are frozen before a run read can recycle their slots
+        parts = []
+        frozen = 0
+
+        def freeze():
+            nonlocal frozen
+            for k in range(frozen, len(parts)):
+                if isinstance(parts[k], memoryview):
+                    parts[k] = bytes(parts[k])
+            frozen = len(parts)
+
+        def place(i: int, block):
+            # the part of the i-th block of the range that falls inside [offset, offset + size)
+            lo = skip if i == 0 else 0
+            hi = min(bs, skip + size - i * bs)
+            parts.append(block[lo:hi])
+
+        # Read buffer: cached blocks are sliced straight from their page, each run of
+        # adjacent uncached blocks is read with one preadv straight into fresh pages
+        addrs = self._get_data_block_addrs(curr_inode, start_block_idx, end_block_idx + 1)
+        max_run = self.page_cache.capacity
+        run_start = 0
+        for i in range(len(addrs) + 1):
+            addr = addrs[i] if i < len(addrs) else 0
+            page = self.page_cache.get(addr) if addr else None
+            extends_run = (addr and page is None and i > run_start
+                           and addr == addrs[i - 1] + 1 and i - run_start < max_run)
+            if i > run_start and not extends_run:
+                freeze()
+                for k, run_page in enumerate(self.page_cache.load_run(addrs[run_start], i - run_start)):
+                    place(run_start + k, run_page.data)
+                run_start = i
+                # the flush may have cached (or evicted) this block
+                if addr:
+                    page = self.page_cache.get(addr)
+            if i == len(addrs):
+                break
+            if page is not None:
+                place(i, page.data)
+                run_start = i + 1
+            elif not addr:
+                # a hole (address 0) reads as zeros
+                place(i, self._zero_block)
+                run_start = i + 1
+        data = b"".join(parts)
+
+        # Add Journal record metadata (access time), relatime style: only when the last access
+        # predates the last change or is a day old, so repeated reads do not each commit
+        now = int(time.time())
+        atime = curr_inode.atime
+        if atime != now and (atime <= max(curr_inode.mtime, curr_inode.ctime) or now - atime >= RELATIME_INTERVAL):
+            with self.journal.begin() as tx:
+                curr_inode.atime = now
+                self._iput(curr_file_state.ino, curr_inode, tx)
 
-        return bytes(data)
+        return data
     
     def unlink(self, path):
-        print(f"--- unlink called for: {path} ---")
-        parent_path, curr_name = self._split(path)
-        parent_ino = self._lookup(parent_path)
-        parent_inode = self._iget(parent_ino)
-
-        curr_ino = self._lookup(path)
+        log.debug("unlink %s", path)
+        parent_ino, parent_inode, curr_name, curr_ino = self._lookup_parent(path)
+        if curr_ino is None:
+            raise OSError(errno.ENOENT, "No such file or directory")
         curr_inode = self._iget(curr_ino)
-
-        old_parent_entries = self._read_dir_entries(parent_inode)
-        print(f"unlink: old_parent_entries = {old_parent_entries}")
-        new_parent_entries = []
-        for child_ino, child_name in old_parent_entries:
-            if child_name == curr_name:
-                continue
-            new_parent_entries.append((child_ino, child_name))
-
-        assert len(old_parent_entries) == len(new_parent_entries) + 1
+        # before the entry goes: a failed unlink must leave the parent as it was
+        if (curr_inode.mode & S_IFMT) == S_IFDIR:
+            raise OSError(errno.EISDIR, "Is a directory")
 
         # write back entries of parent
         touched_data_blocks = []
-        self._write_dir_entries(parent_inode, new_parent_entries, touched_data_blocks)
-        if (curr_inode.mode & InodeMode.S_IFMT) == InodeMode.S_IFDIR:
-            raise OSError(errno.EISDIR, "Is a directory")
+        self._remove_dir_entry(parent_inode, curr_name, touched_data_blocks)
+        self.dentry_cache.remove(parent_ino, curr_name)
 
         curr_inode.nlink -= 1
-        print(f"unlink: new_parent_entries = {new_parent_entries}")
+        log.debug("unlink: removed %s (ino %d) from parent %d", curr_name, curr_ino, parent_ino)
 
         with self.journal.begin() as tx:
             if curr_inode.nlink == 0:
-                # Remove all block and set free
-                is_symlink = (curr_inode.mode & InodeMode.S_IFMT) == InodeMode.S_IFLNK
-                is_slow_link = is_symlink and curr_inode.size > 48
-                is_regular_or_slow_link = not is_symlink or is_slow_link
-
-                if is_regular_or_slow_link:
-                    ADDRS_PER_BLOCK = self.sb.block_size // 4
-                    SINGLY_LIMIT = 10
-                    DOUBLY_LIMIT = SINGLY_LIMIT + ADDRS_PER_BLOCK
-                    original_blks = ceil_div(curr_inode.size, self.sb.block_size)
-                    self._free_data_blocks(curr_inode, 0, original_blks, touched_data_blocks) 
-
-                    if original_blks > SINGLY_LIMIT:
-                        self._free_block(curr_inode.direct[10])
-
-                    if original_blks > DOUBLY_LIMIT:
-                        l1_block_content = bytearray(self._read_block_cached(curr_inode.direct[11]))
-                        ptr = 0
-                        for i in range(ADDRS_PER_BLOCK):
-                            l2_addr = struct.unpack("<I", l1_block_content[ptr:ptr+4])[0]
-                            if l2_addr != 0:
-                                self._free_block(l2_addr)
-                            else:
-                                break
-                            ptr += 4
-                        self._free_block(curr_inode.direct[11])
+                # Remove all block and set free; a fast symlink keeps its target in direct[]
+                # and owns no blocks
+                if (curr_inode.mode & S_IFMT) != S_IFLNK or curr_inode.size > 48:
+                    original_blks = ceil_div(curr_inode.size, self._bs)
+                    # the inode is going away, so its pointer blocks are freed rather than cleared
+                    self._free_data_blocks(curr_inode, 0, original_blks - 1, touched_data_blocks, zero_ptrs=False)
+                    self._free_indirect_blocks(curr_inode, 0)
 
                 self._free_inode(curr_ino)
             else:
-                self.inode_table.write(curr_ino, curr_inode, tx)
+                self._iput(curr_ino, curr_inode, tx)
 
             for block_addr in touched_data_blocks:
                 tx.add_data_dependency(block_addr)
 
             parent_inode.mtime = parent_inode.ctime = int(time.time())
             # write back of parent inode to inode table
-            self.inode_table.write(parent_ino, parent_inode, tx)
+            self._iput(parent_ino, parent_inode, tx)
 
             self.block_bitmap.flush(tx)
             self.inode_bitmap.flush(tx)
-
-        self.dentry_cache.remove(path)
     
     def truncate(self, path, length, fh=None):
         ino = self._lookup(path)
         inode = self._iget(ino)
 
-        ADDRS_PER_BLOCK = self.sb.block_size // 4
-        SINGLY_LIMIT = 10
-        DOUBLY_LIMIT = SINGLY_LIMIT + ADDRS_PER_BLOCK
-
-        original_blks = ceil_div(inode.size, self.sb.block_size)
-        need_blks = ceil_div(length, self.sb.block_size)
+        original_blks = ceil_div(inode.size, self._bs)
+        need_blks = ceil_div(length, self._bs)
 
         if need_blks > self.MAX_BLOCKS:
             raise OSError(errno.EFBIG, "File too large for direct blocks")
 
         touched_data_blocks = []
+        zeroed_on_disk = False
         # extend
         if length > inode.size:
-            for i in range(original_blks, need_blks):
-                addr = self._get_or_alloc_data_block_addr(inode, i, touched_data_blocks)
-                # write all 0 into new_blk
-                self._write_block_cached(addr,  b'\x00' * self.sb.block_size)
-                touched_data_blocks.append(addr)
+            if need_blks - original_blks > 1:
+                self._reserve_blocks(need_blks - original_blks)
+            try:
+                # zeroed on disk below, not in the cache
+                new_addrs = [self._get_or_alloc_data_block_addr(inode, i, touched_data_blocks, zero_fill=False)
+                             for i in range(original_blks, need_blks)]
+            finally:
+                self._release_reserved()
+            # write all 0 into the new blocks straight to disk: no page per block, and a freed
+            # block's stale page must not be written back over the zeros later
+            for addr in new_addrs:
+                self.page_cache.discard(addr)
+                self.dir_cache.remove(addr)
+            self.disk.zero_blocks(sorted(new_addrs))
+            zeroed_on_disk = bool(new_addrs)
                     
         else:
             self._free_data_blocks(inode, need_blks, original_blks-1, touched_data_blocks)
-
-            if need_blks < DOUBLY_LIMIT and inode.direct[11] != 0:
-                l1_block_content = bytearray(self._read_block_cached(inode.direct[11]))
-                ptr = 0
-                for i in range(ADDRS_PER_BLOCK):
-                    l2_addr = struct.unpack("<I", l1_block_content[ptr:ptr+4])[0]
-                    if l2_addr != 0:
-                        self._free_block(l2_addr)
-                    else:
-                        break
-                    ptr += 4
-                self._free_block(inode.direct[11])
-                inode.direct[11] = 0
-
-            if need_blks < SINGLY_LIMIT and inode.direct[10] != 0:
-                self._free_block(inode.direct[10])
-                inode.direct[10] = 0
+            self._free_indirect_blocks(inode, need_blks)
 
         with self.journal.begin() as tx:
 
             for block_addr in touched_data_blocks:
                 tx.add_data_dependency(block_addr)
+            # ordered mode: the zeros are durable before the larger size commits, under the
+            # same barrier as the pointer blocks
+            if zeroed_on_disk:
+                tx.add_unsynced_data()
 
             inode.size = length
             inode.mtime = inode.ctime = int(time.time())
-            self.inode_table.write(ino, inode, tx)
+            self._iput(ino, inode, tx)
             self.block_bitmap.flush(tx)
     
     def rename(self, old, new):
         if old == new:
             return
         
-        try:
-            ino = self._lookup(new)
-            inode = self.inode_table.read(ino)
-            if (inode.mode & InodeMode.S_IFMT) == InodeMode.S_IFDIR:
-                self.rmdir(new)
-            else:
-                self.unlink(new)
-            self.dentry_cache.remove(new)
-        except OSError:
-            pass
-
-        old_parent_path, old_name = self._split(old)
-        old_parent_ino = self._lookup(old_parent_path)
-        old_parent_inode = self._iget(old_parent_ino)
-
-        new_parent_path, new_name = self._split(new)
-        new_parent_ino = self._lookup(new_parent_path)
-        new_parent_inode = self._iget(new_parent_ino)
-
-        if (old_parent_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
-            raise OSError(errno.ENOENT, "No such directory") 
-        
-        if (new_parent_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
-            raise OSError(errno.ENOENT, "No such directory") 
-        
-        old_parent_dentry = self._read_dir_entries(old_parent_inode)
-        curr_ino = None
-        for ino, name in old_parent_dentry:
-            if name == old_name:
-                curr_ino = ino
-                break
-        
-        if curr_ino is None:
-            raise OSError(errno.ENOENT, "Source path does not exist")
-        
-        curr_inode = self._iget(curr_ino)
-
-        old_parent_dentry = [entry for entry in old_parent_dentry if entry[1] != old_name]
-        touched_data_blocks = []
-        self._write_dir_entries(old_parent_inode, old_parent_dentry, touched_data_blocks)
-
-        new_parent_dentry = self._read_dir_entries(new_parent_inode)
-        new_parent_dentry.append((curr_ino, new_name))
-
-        if (curr_inode.mode & InodeMode.S_IFMT) == InodeMode.S_IFDIR:
-            if old_parent_ino != new_parent_ino:
-                old_parent_inode.nlink -= 1
-                new_parent_inode.nlink += 1
-                curr_inode_dentry = self._read_dir_entries(curr_inode)
-                curr_inode_dentry.remove((old_parent_ino, ".."))
-                curr_inode_dentry.append((new_parent_ino, ".."))
-                self._write_dir_entries(curr_inode, curr_inode_dentry)
-        
-        # Write old and new parent d-entry
-        self._write_dir_entries(old_parent_inode, old_parent_dentry, touched_data_blocks)
-        self._write_dir_entries(new_parent_inode, new_parent_dentry, touched_data_blocks)
-
-        # Update Inode Table
+        # replacing the target and moving the entry commit together: the unlink or rmdir
+        # below joins the transaction begun here instead of committing on its own
         with self.journal.begin() as tx:
+            # the source is checked before the target goes: a failed rename leaves both in place
+            if self._lookup_parent(old)[3] is None:
+                raise OSError(errno.ENOENT, "Source path does not exist")
+            # an existing target is replaced; if it cannot go (a non-empty directory), the
+            # rename fails as a whole rather than adding a second entry of the same name
+            target_ino = self._lookup_parent(new)[3]
+            if target_ino is not None:
+                if (self._iget(target_ino).mode & S_IFMT) == S_IFDIR:
+                    self.rmdir(new)
+                else:
+                    self.unlink(new)
+
+            old_parent_ino, old_parent_inode, old_name, curr_ino = self._lookup_parent(old)
+            new_parent_ino, new_parent_inode, new_name, _ = self._lookup_parent(new)
+            if curr_ino is None:
+                raise OSError(errno.ENOENT, "Source path does not exist")
+            if new_parent_ino == old_parent_ino:
+                # one directory: both edits go to the same inode, so it is written once
+                new_parent_inode = old_parent_inode
+        
+            curr_inode = self._iget(curr_ino)
 
+            # move the one entry; the other names in both parents are left as they are
+            touched_data_blocks = []
+            if new_parent_ino == old_parent_ino:
+                # renamed in its slot: one edit and one block write for the directory
+                self._replace_dir_entry(old_parent_inode, old_name, curr_ino, new_name, touched_data_blocks)
+            else:
+                # the add can run out of room, so it goes first, before the source entry is gone
+                self._add_dir_entry(new_parent_inode, curr_ino, new_name, touched_data_blocks)
+                self._remove_dir_entry(old_parent_inode, old_name, touched_data_blocks)
+            # the one pair that changed; names below a moved directory still hang off the same ino
+            self.dentry_cache.remove(old_parent_ino, old_name)
+
+            if (curr_inode.mode & S_IFMT) == S_IFDIR:
+                if old_parent_ino != new_parent_ino:
+                    old_parent_inode.nlink -= 1
+                    new_parent_inode.nlink += 1
+                    self._replace_dir_entry(curr_inode, "..", new_parent_ino, "..", touched_data_blocks)
+
+            # Update Inode Table
             for block_addr in touched_data_blocks:
                 tx.add_data_dependency(block_addr)
 
@@ -831,25 +1025,25 @@ class WayneFS(LoggingMixIn, Operations):
             old_parent_inode.mtime = old_parent_inode.ctime = current_time
             new_parent_inode.mtime = new_parent_inode.ctime = current_time
             curr_inode.ctime = current_time
-            self.inode_table.write(old_parent_ino, old_parent_inode, tx)
-            self.inode_table.write(new_parent_ino, new_parent_inode, tx)
-            self.inode_table.write(curr_ino, curr_inode, tx)
-
-        self.dentry_cache.remove(old)
+            self._iput(old_parent_ino, old_parent_inode, tx)
+            if new_parent_ino != old_parent_ino:
+                self._iput(new_parent_ino, new_parent_inode, tx)
+            self._iput(curr_ino, curr_inode, tx)
     
     def utimens(self, path, times=None):
         ino = self._lookup(path)
         inode = self._iget(ino)
 
+        # one clock read serves the change time and, for a plain touch, both stamps
+        now = int(time.time())
         if times == None:
-            now = time.time()
             times = (now, now)
 
         with self.journal.begin() as tx:
             inode.atime = int(times[0])
             inode.mtime = int(times[1])
-            inode.ctime = int(time.time())
-            self.inode_table.write(ino, inode, tx)
+            inode.ctime = now
+            self._iput(ino, inode, tx)
 
         return 0
     
@@ -858,45 +1052,30 @@ class WayneFS(LoggingMixIn, Operations):
         inode = self._iget(ino)
 
         with self.journal.begin() as tx:
-            inode.mode = (inode.mode & InodeMode.S_IFMT) | (mode & 0o777)
+            inode.mode = (inode.mode & S_IFMT) | (mode & 0o777)
             inode.ctime = int(time.time())
-            self.inode_table.write(ino, inode, tx)
+            self._iput(ino, inode, tx)
 
         return 0
     
     def link(self, target, source):
-        print(f"--- link called: source='{source}', target='{target}' ---")
-        src_parent_path, src_name = self._split(source)
-        src_parent_ino = self._lookup(src_parent_path)
-        src_parent_inode = self._iget(src_parent_ino)
-
-        curr_ino = None
-        for child_ino, child_name in self._read_dir_entries(src_parent_inode):
-            if child_name == src_name:
-                curr_ino = child_ino
-                break
-
-        if curr_ino == None:
+        log.debug("link source=%r target=%r", source, target)
+        # each side is one walk to its parent and one probe of the parent's name map
+        _, _, _, curr_ino = self._lookup_parent(source)
+        if curr_ino is None:
             raise OSError(errno.ENOENT, "Source path does not exist")
         
         curr_inode = self._iget(curr_ino)
 
-        if (curr_inode.mode & InodeMode.S_IFMT) == InodeMode.S_IFDIR:
+        if (curr_inode.mode & S_IFMT) == S_IFDIR:
             raise OSError(errno.EPERM, "Hard link not allowed for directory")
         
-        trg_parent_path, trg_name = self._split(target)
-        trg_parent_ino = self._lookup(trg_parent_path)
-        trg_parent_inode = self._iget(trg_parent_ino)
-
+        trg_parent_ino, trg_parent_inode, trg_name, existing_ino = self._lookup_parent(target)
         # Check trg_name is not existed
-        trg_dentry = self._read_dir_entries(trg_parent_inode)
-        for child_ino, child_name in trg_dentry:
-            if child_name == trg_name:
-                raise OSError(errno.EEXIST, "File is existed")
-            
-        trg_dentry.append((curr_ino, trg_name))
+        if existing_ino is not None:
+            raise OSError(errno.EEXIST, "File is existed")
         touched_data_blocks = []
-        self._write_dir_entries(trg_parent_inode, trg_dentry, touched_data_blocks)
+        self._add_dir_entry(trg_parent_inode, curr_ino, trg_name, touched_data_blocks)
         
         with self.journal.begin() as tx:
 
@@ -907,32 +1086,23 @@ class WayneFS(LoggingMixIn, Operations):
             curr_inode.ctime = curr_time
             curr_inode.nlink += 1
             trg_parent_inode.ctime = trg_parent_inode.mtime = curr_time
-            self.inode_table.write(curr_ino, curr_inode, tx)
-            self.inode_table.write(trg_parent_ino, trg_parent_inode, tx)
+            self._iput(curr_ino, curr_inode, tx)
+            self._iput(trg_parent_ino, trg_parent_inode, tx)
 
-        print("link ()", source, "->" ,target)
-        print("curr_ino = ", curr_ino)
-        print("trg_dentry = ", trg_dentry)
-        print("trg_parent_ino = ", trg_parent_ino)
+        log.debug("link %s -> %s: ino=%d, parent=%d", source, target, curr_ino, trg_parent_ino)
 
         return 0
     
     def symlink(self, target: str, source: str):
-        print(f"--- symlink called: source='{source}', target='{target}' ---")
-        link_parent_path, link_name = self._split(target)
-        self.dentry_cache.remove(link_parent_path)
-
-        link_parent_ino = self._lookup(link_parent_path)
-        link_parent_inode = self._iget(link_parent_ino)
-    
-        if (link_parent_inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFDIR:
-            raise OSError(errno.ENOENT, "Parent directory does not exist")
+        log.debug("symlink source=%r target=%r", source, target)
+        link_parent_ino, link_parent_inode, link_name, existing_ino = self._lookup_parent(target)
+        # a second entry of the same name would shadow the first in the name map
+        if existing_ino is not None:
+            raise OSError(errno.EEXIST, "File is existed")
         
-        parent_entries = self._read_dir_entries(link_parent_inode)
         curr_ino = self._alloc_inode()
-        parent_entries.append((curr_ino, link_name))
         touched_data_blocks = []
-        self._write_dir_entries(link_parent_inode, parent_entries, touched_data_blocks)
+        self._add_dir_entry(link_parent_inode, curr_ino, link_name, touched_data_blocks)
 
         target_bytes = source.encode('utf-8')
         target_len = len(target_bytes)
@@ -940,35 +1110,43 @@ class WayneFS(LoggingMixIn, Operations):
         is_slow = target_len > 48
 
         with self.journal.begin() as tx:
-            curr_inode = Inode.empty(mode=(InodeMode.S_IFLNK | 0o777))
+            curr_inode = Inode.empty(mode=(S_IFLNK | 0o777))
             curr_inode.nlink = 1
             curr_inode.size = target_len
 
             if is_slow:
-                start_block_idx = 0
-                end_block_idx = (target_len - 1) // self.sb.block_size
-                ptr = 0
-                for curr_block_idx in range(start_block_idx, end_block_idx+1):
-                    addr = self._get_or_alloc_data_block_addr(curr_inode, curr_block_idx, touched_data_blocks)
-                    data = target_bytes[ptr:ptr+self.sb.block_size]
-                    self._write_block_cached(addr, data.ljust(self.sb.block_size, b'\x00'))
-                    ptr += self.sb.block_size
-                    touched_data_blocks.append(addr)
+                bs = self._bs
+                view = memoryview(target_bytes)
+                nblocks = ceil_div(target_len, bs)
+                # adjacent blocks, so the commit flushes the target with one vectored write
+                if nblocks > 1:
+                    self._reserve_blocks(nblocks)
+                try:
+                    for curr_block_idx in range(nblocks):
+                        # the page takes the target slice zero-padded, so no zero fill first
+                        addr = self._get_or_alloc_data_block_addr(curr_inode, curr_block_idx, touched_data_blocks,
+                                                                  zero_fill=False)
+                        self._write_block_cached(addr, view[curr_block_idx * bs : (curr_block_idx + 1) * bs])
+                        touched_data_blocks.append(addr)
+                finally:
+                    self._release_reserved()
             else:
-                padded_target = target_bytes.ljust(48, b'\x00')
-                curr_inode.direct = list(struct.unpack("<12I", padded_target))
+                # padded in a reused scratch buffer rather than a fresh ljust copy
+                inline = self._inline_buf
+                inline[:target_len] = target_bytes
+                inline[target_len:] = self._zero_view[target_len:DIRECT_STRUCT.size]
+                curr_inode.direct = list(DIRECT_STRUCT.unpack(inline))
             
             for block_addr in touched_data_blocks:
                 tx.add_data_dependency(block_addr)
 
-            self.inode_table.write(curr_ino, curr_inode, tx)
+            self._iput(curr_ino, curr_inode, tx)
             link_parent_inode.ctime = link_parent_inode.mtime = curr_inode.ctime
-            self.inode_table.write(link_parent_ino, link_parent_inode, tx)
+            self._iput(link_parent_ino, link_parent_inode, tx)
             self.inode_bitmap.flush(tx)
 
             if is_slow:
                 self.block_bitmap.flush(tx)
-        print(f"--- symlink called end ---")
         return 0
 
 
@@ -976,35 +1154,20 @@ class WayneFS(LoggingMixIn, Operations):
         ino = self._lookup(path)
         inode = self._iget(ino)
 
-        if (inode.mode & InodeMode.S_IFMT) != InodeMode.S_IFLNK:
+        if (inode.mode & S_IFMT) != S_IFLNK:
             raise OSError(errno.EINVAL, "Not a symbolic link")
     
-        target_len = inode.size
-        target = bytearray()
-
-        if target_len <= 48:
-            target = struct.pack("<12I", *inode.direct)
-        else:
-            start_block_idx = 0
-            end_block_idx = (target_len - 1) // self.sb.block_size
-            for curr_block_idx in range(start_block_idx, end_block_idx+1):
-                addr = self._get_data_block_addr(inode, curr_block_idx)
-                data = self._read_block_cached(addr)
-                target += data
-
-        return target[:target_len].decode('utf-8')
+        return self._read_link_target(ino, inode)
     
     def statfs(self, path):
-        print(f"--- statfs called ---")
         f_files_val = self.sb.inode_count
         f_ffree_val = self.inode_bitmap.free_count
         f_blocks_val = self.sb.total_blocks
         f_bfree_val = self.block_bitmap.free_count
-        print(f"statfs: f_files={f_files_val}, f_ffree={f_ffree_val}")
-        print(f"statfs: f_blocks={f_blocks_val}, f_bfree={f_bfree_val}")
+        log.debug("statfs: f_files=%d, f_ffree=%d, f_blocks=%d, f_bfree=%d", f_files_val, f_ffree_val, f_blocks_val, f_bfree_val)
         return dict(
-            f_bsize=self.sb.block_size,
-            f_frsize=self.sb.block_size,
+            f_bsize=self._bs,
+            f_frsize=self._bs,
             f_blocks=self.sb.total_blocks,
             f_bfree=self.block_bitmap.free_count,
             f_bavail=self.block_bitmap.free_count,
@@ -1019,8 +1182,14 @@ class WayneFS(LoggingMixIn, Operations):
     def fsync(self, path, datasync, fh):
         self.sync_data_cache()
     
+    def release(self, path, fh):
+        # last close of fh: drop its state so the table does not grow with every open
+        self.open_file_table.pop(fh, None)
+        return 0
+
     def destroy(self, path):
         self.sync_data_cache()
+        self.journal.close()
         self.disk.close()
 
 def main():
@@ -1029,8 +1198,16 @@ def main():
     ap.add_argument("--mountpoint", default="mnt")
     ap.add_argument("--foreground", default=False)
     ap.add_argument("--debug", default=False)
+    # how long the kernel may keep names and attributes without asking again (libfuse's
+    # defaults). The image is only changed through this mount, and the kernel updates its own
+    # dentries on every rename/unlink/link it forwards, so longer timeouts stay coherent
+    ap.add_argument("--entry-timeout", type=float, default=1.0)
+    ap.add_argument("--attr-timeout", type=float, default=1.0)
     args = ap.parse_args()
-    FUSE(WayneFS(args.image), args.mountpoint, foreground=args.foreground, debug=args.debug)
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    FUSE(WayneFS(args.image), args.mountpoint, foreground=args.foreground, debug=args.debug,
+         big_writes=True, max_write=MAX_WRITE,
+         entry_timeout=args.entry_timeout, attr_timeout=args.attr_timeout)
 
 if __name__ == "__main__":
     main()